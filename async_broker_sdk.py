@@ -0,0 +1,424 @@
+# coding: utf-8
+
+"""
+Asyncio client for the Open Service Broker V1 service.
+
+`AsyncOpenServiceBrokerV1` mirrors the operations of `broker_sdk.OpenServiceBrokerV1`
+but sends requests through a pooled `httpx` transport (`transport.PooledTransport`),
+so a single event loop can keep many upstream calls in flight at once.
+"""
+
+import asyncio
+import time
+
+import httpx
+from ibm_cloud_sdk_core import ApiException, BaseService, DetailedResponse
+from ibm_cloud_sdk_core.authenticators.authenticator import Authenticator
+from ibm_cloud_sdk_core.utils import convert_model
+
+from broker_sdk import BindResource, Context, OpenServiceBrokerV1
+from common import OPERATIONS
+from deadline import current_deadline
+from passthrough import RawDetailedResponse
+from retry import RetryPolicy
+from single_flight import SingleFlight
+from upstream_pool import UpstreamPool
+from transport import DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_KEEPALIVE_CONNECTIONS, DEFAULT_TIMEOUT, PooledTransport
+
+DEFAULT_STREAM_THRESHOLD = 64 * 1024
+
+##############################################################################
+# Service
+##############################################################################
+
+
+class AsyncOpenServiceBrokerV1(BaseService):
+    """The Open Service Broker V1 service (asyncio)."""
+
+    DEFAULT_SERVICE_URL = OpenServiceBrokerV1.DEFAULT_SERVICE_URL
+    DEFAULT_SERVICE_NAME = OpenServiceBrokerV1.DEFAULT_SERVICE_NAME
+
+    def __init__(
+        self,
+        authenticator: Authenticator = None,
+        *,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        timeout: float = DEFAULT_TIMEOUT,
+        single_flight: SingleFlight = None,
+        transport: PooledTransport = None,
+        stream_threshold: int = DEFAULT_STREAM_THRESHOLD,
+        retry_policy: RetryPolicy = None,
+        upstream_pool: UpstreamPool = None,
+    ) -> None:
+        """
+        Construct a new asyncio client for the Open Service Broker service.
+
+        :param Authenticator authenticator: The authenticator specifies the authentication mechanism.
+        :param int max_connections: Upper bound of open upstream connections.
+        :param int max_keepalive_connections: Idle connections kept in the pool.
+        :param float timeout: Default upstream timeout, in seconds.
+        :param SingleFlight single_flight: (optional) Group used to coalesce
+               identical in-flight GET requests; a default group is created if omitted.
+        :param PooledTransport transport: (optional) Upstream connection pools; when
+               given, `max_connections`, `max_keepalive_connections` and `timeout` are ignored.
+        :param int stream_threshold: Size in bytes above which the body of an
+               operation called with `stream=True` is streamed instead of read.
+        :param RetryPolicy retry_policy: (optional) Retries of transient upstream
+               failures; requests are not retried if omitted.
+        :param UpstreamPool upstream_pool: (optional) Replicas of the upstream broker
+               each attempt is balanced over; requests go to the service URL if omitted.
+        """
+        BaseService.__init__(self, service_url=self.DEFAULT_SERVICE_URL, authenticator=authenticator)
+        if transport is None:
+            transport = PooledTransport(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                timeout=timeout,
+            )
+        self.transport = transport
+        self.stream_threshold = stream_threshold
+        self.retry_policy = retry_policy
+        self.upstream_pool = upstream_pool
+        self.single_flight = single_flight if single_flight is not None else SingleFlight()
+
+    async def close(self) -> None:
+        """Close the pooled upstream connections."""
+        await self.transport.aclose()
+
+    async def __aenter__(self) -> 'AsyncOpenServiceBrokerV1':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    #########################
+    # Request plumbing
+    #########################
+
+    def _token_fetch_pending(self) -> bool:
+        """Return `True` when authenticating the next request would block on IAM."""
+        token_manager = getattr(self.authenticator, 'token_manager', None)
+        if token_manager is None:
+            return False
+        now = int(time.time())
+        return token_manager.expire_time < now or token_manager.refresh_time < now
+
+    async def _prepare_request(self, method: str, url: str, **kwargs) -> dict:
+        """Build the request dict, moving blocking token exchanges off the event loop."""
+        if self._token_fetch_pending():
+            return await asyncio.to_thread(self.prepare_request, method=method, url=url, **kwargs)
+        return self.prepare_request(method=method, url=url, **kwargs)
+
+    async def send(self, request: dict, *, stream: bool = False, **kwargs) -> DetailedResponse:
+        """
+        Send a request and wrap the response in a RawDetailedResponse or ApiException.
+
+        Concurrent GET requests for the same path and query share one upstream round
+        trip (retries included) and all receive its response.
+
+        :param dict request: The request built by `prepare_request`.
+        :param bool stream: Leave a successful body larger than `stream_threshold`
+               (or of unknown length) unread, to be streamed by the caller.
+        :return: A `RawDetailedResponse` containing the result, headers and HTTP status code.
+        :rtype: DetailedResponse
+        """
+        if request['method'] == 'GET' and not stream:
+            key = (request['method'], request['url'], tuple(sorted((request['params'] or {}).items())))
+            return await self.single_flight.do(key, lambda: self._send_with_retry(request, **kwargs))
+        return await self._send_with_retry(request, stream=stream, **kwargs)
+
+    async def _send_with_retry(self, request: dict, **kwargs) -> DetailedResponse:
+        if self.retry_policy is None:
+            return await self._attempt(request, **kwargs)
+        return await self.retry_policy.call(request, lambda: self._attempt(request, **kwargs))
+
+    async def _attempt(self, request: dict, **kwargs) -> DetailedResponse:
+        if self.upstream_pool is None:
+            return await self._send(request, **kwargs)
+        return await self.upstream_pool.call(request, lambda routed: self._send(routed, **kwargs))
+
+    async def _send(self, request: dict, *, stream: bool = False, **kwargs) -> DetailedResponse:
+        deadline = current_deadline()
+        if deadline is not None and 'timeout' not in kwargs:
+            # Connect / read timeouts from the budget left to the incoming request
+            kwargs['timeout'] = deadline.httpx_timeout()
+        response = await self.transport.request(
+            request['method'],
+            request['url'],
+            stream=True,
+            headers=dict(request['headers']),
+            params=request['params'],
+            content=request['data'],
+            **kwargs,
+        )
+        if stream and 200 <= response.status_code <= 299 and self._streamable(response):
+            return RawDetailedResponse(stream=response, headers=response.headers, status_code=response.status_code)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+
+        if 200 <= response.status_code <= 299:
+            if request['method'] == 'HEAD':
+                content = None
+            return RawDetailedResponse(content=content, headers=response.headers, status_code=response.status_code)
+
+        raise ApiException(response.status_code, message=_get_error_message(response), http_response=response)
+
+    def _streamable(self, response: httpx.Response) -> bool:
+        content_length = response.headers.get('Content-Length')
+        return content_length is None or int(content_length) > self.stream_threshold
+
+    #########################
+    # Enable and Disable Instances
+    #########################
+
+    async def get_service_instance_state(self, instance_id: str, **kwargs) -> DetailedResponse:
+        """
+        Get the current state of the service instance.
+
+        See `OpenServiceBrokerV1.get_service_instance_state`.
+        """
+
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        template = OPERATIONS['get_service_instance_state']
+        headers = template.headers(kwargs.get('headers'))
+        url = template.url(instance_id)
+        request = await self._prepare_request(template.method, url, headers=headers)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    async def replace_service_instance_state(
+        self, instance_id: str, *, enabled: bool = None, initiator_id: str = None, reason_code: str = None, **kwargs
+    ) -> DetailedResponse:
+        """
+        Update the state of a provisioned service instance.
+
+        See `OpenServiceBrokerV1.replace_service_instance_state`.
+        """
+
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        template = OPERATIONS['replace_service_instance_state']
+        headers = template.headers(kwargs.get('headers'))
+        data = template.body(enabled, initiator_id, reason_code)
+        url = template.url(instance_id)
+        request = await self._prepare_request(template.method, url, headers=headers, data=data)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    #########################
+    # Resource Instances
+    #########################
+
+    async def replace_service_instance(
+        self,
+        instance_id: str,
+        *,
+        organization_guid: str = None,
+        plan_id: str = None,
+        service_id: str = None,
+        space_guid: str = None,
+        context: 'Context' = None,
+        parameters: dict = None,
+        accepts_incomplete: bool = None,
+        **kwargs,
+    ) -> DetailedResponse:
+        """
+        Create (provision) a service instance.
+
+        See `OpenServiceBrokerV1.replace_service_instance`.
+        """
+
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        if context is not None:
+            context = convert_model(context)
+        template = OPERATIONS['replace_service_instance']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(accepts_incomplete)
+        data = template.body(organization_guid, plan_id, service_id, space_guid, context, parameters)
+        url = template.url(instance_id)
+        request = await self._prepare_request(template.method, url, headers=headers, params=params, data=data)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    async def update_service_instance(
+        self,
+        instance_id: str,
+        *,
+        service_id: str = None,
+        context: 'Context' = None,
+        parameters: dict = None,
+        plan_id: str = None,
+        previous_values: dict = None,
+        accepts_incomplete: bool = None,
+        **kwargs,
+    ) -> DetailedResponse:
+        """
+        Update a service instance.
+
+        See `OpenServiceBrokerV1.update_service_instance`.
+        """
+
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        if context is not None:
+            context = convert_model(context)
+        template = OPERATIONS['update_service_instance']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(accepts_incomplete)
+        data = template.body(service_id, context, parameters, plan_id, previous_values)
+        url = template.url(instance_id)
+        request = await self._prepare_request(template.method, url, headers=headers, params=params, data=data)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    async def delete_service_instance(
+        self, service_id: str, plan_id: str, instance_id: str, *, accepts_incomplete: bool = None, **kwargs
+    ) -> DetailedResponse:
+        """
+        Delete (deprovision) a service instance.
+
+        See `OpenServiceBrokerV1.delete_service_instance`.
+        """
+
+        if service_id is None:
+            raise ValueError('service_id must be provided')
+        if plan_id is None:
+            raise ValueError('plan_id must be provided')
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        template = OPERATIONS['delete_service_instance']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(service_id, plan_id, accepts_incomplete)
+        url = template.url(instance_id)
+        request = await self._prepare_request(template.method, url, headers=headers, params=params)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    #########################
+    # Catalog
+    #########################
+
+    async def list_catalog(self, **kwargs) -> DetailedResponse:
+        """
+        Get the catalog metadata stored within the broker.
+
+        See `OpenServiceBrokerV1.list_catalog`.
+        """
+
+        template = OPERATIONS['list_catalog']
+        headers = template.headers(kwargs.get('headers'))
+        url = template.path
+        request = await self._prepare_request(template.method, url, headers=headers)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    #########################
+    # Last Operation (Async)
+    #########################
+
+    async def get_last_operation(
+        self, instance_id: str, *, operation: str = None, plan_id: str = None, service_id: str = None, **kwargs
+    ) -> DetailedResponse:
+        """
+        Get the current status of a provision in-progress for a service instance.
+
+        See `OpenServiceBrokerV1.get_last_operation`.
+        """
+
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        template = OPERATIONS['get_last_operation']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(operation, plan_id, service_id)
+        url = template.url(instance_id)
+        request = await self._prepare_request(template.method, url, headers=headers, params=params)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    #########################
+    # Bindings and Credentials
+    #########################
+
+    async def replace_service_binding(
+        self,
+        binding_id: str,
+        instance_id: str,
+        *,
+        plan_id: str = None,
+        service_id: str = None,
+        bind_resource: 'BindResource' = None,
+        parameters: dict = None,
+        **kwargs,
+    ) -> DetailedResponse:
+        """
+        Bind a service instance to another resource.
+
+        See `OpenServiceBrokerV1.replace_service_binding`.
+        """
+
+        if binding_id is None:
+            raise ValueError('binding_id must be provided')
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        if bind_resource is not None:
+            bind_resource = convert_model(bind_resource)
+        template = OPERATIONS['replace_service_binding']
+        headers = template.headers(kwargs.get('headers'))
+        data = template.body(plan_id, service_id, bind_resource, parameters)
+        url = template.url(instance_id, binding_id)
+        request = await self._prepare_request(template.method, url, headers=headers, data=data)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+    async def delete_service_binding(
+        self, binding_id: str, instance_id: str, plan_id: str, service_id: str, **kwargs
+    ) -> DetailedResponse:
+        """
+        Delete (unbind) the credentials bound to a resource.
+
+        See `OpenServiceBrokerV1.delete_service_binding`.
+        """
+
+        if binding_id is None:
+            raise ValueError('binding_id must be provided')
+        if instance_id is None:
+            raise ValueError('instance_id must be provided')
+        if plan_id is None:
+            raise ValueError('plan_id must be provided')
+        if service_id is None:
+            raise ValueError('service_id must be provided')
+        template = OPERATIONS['delete_service_binding']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(plan_id, service_id)
+        url = template.url(instance_id, binding_id)
+        request = await self._prepare_request(template.method, url, headers=headers, params=params)
+
+        response = await self.send(request, stream=kwargs.get('stream', False))
+        return response
+
+
+def _get_error_message(response: httpx.Response) -> str:
+    """Extract the error message from an upstream error response."""
+    error_message = 'Unknown error'
+    try:
+        error_json = response.json()
+    except ValueError:
+        return response.text or error_message
+    if isinstance(error_json, dict):
+        for key in ('error', 'message', 'errorMessage', 'description'):
+            if key in error_json:
+                return str(error_json[key])
+    return response.reason_phrase or error_message
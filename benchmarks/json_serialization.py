@@ -0,0 +1,120 @@
+# coding: utf-8
+
+"""
+Microbenchmark of the json backends of `common` on broker payloads.
+
+Compares the stdlib and orjson backends on a provision request body (SDK request
+building), a model `__str__` and a catalog response (API response rendering).
+
+Run from the repository root:
+
+    python benchmarks/json_serialization.py [--services 40] [--plans 6]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broker_sdk import Resp1874650Root  # noqa: E402
+from common import JSON_BACKENDS, json_dumps, json_dumps_bytes, json_loads, set_json_backend  # noqa: E402
+
+
+def provision_body() -> dict:
+    """A provision request body as built by `replace_service_instance`."""
+    return {
+        'organization_guid': 'd35d4f0e-5076-4c89-9361-2522894b6548',
+        'plan_id': 'e1031579-4b42-4169-b7cf-f7793c616fdc',
+        'service_id': '6e0e1ea5-5aee-4c06-9e69-8b1c9bd4e9b0',
+        'space_guid': '4f2b6dd2-4aa5-4f3d-8b53-5a4c1c1a2ab6',
+        'context': {
+            'platform': 'ibmcloud',
+            'account_id': '0f4a3d6c9b8e47f1a2d5c6b7e8f90a1b',
+            'crn': 'crn:v1:bluemix:public:my-service:us-south:a/0f4a3d6c9b8e47f1a2d5c6b7e8f90a1b::',
+            'resource_group_crn': 'crn:v1:bluemix:public:resource-controller::a/0f4a::resource-group:7c1e',
+            'target_crn': 'crn:v1:bluemix:public:globalcatalog::::deployment:my-service-us-south',
+        },
+        'parameters': {
+            'region': 'us-south',
+            'tags': ['env:production', 'team:platform', 'cost-center:4711'],
+            'replicas': 3,
+            'storage_gb': 250,
+            'backup': {'enabled': True, 'retention_days': 30, 'schedule': '0 3 * * *'},
+        },
+    }
+
+
+def catalog(services: int, plans: int) -> dict:
+    """A catalog with `services` services of `plans` plans each."""
+    return {
+        'services': [
+            {
+                'id': 'service-{0:04d}'.format(s),
+                'name': 'service-{0}'.format(s),
+                'description': 'Service number {0}, with a description of realistic length.'.format(s),
+                'bindable': True,
+                'plan_updateable': s % 2 == 0,
+                'tags': ['ibm_created', 'lite', 'data_management'],
+                'metadata': {
+                    'displayName': 'Service {0}'.format(s),
+                    'longDescription': 'Ação de provisionamento com metadados multilíngues. ' * 3,
+                    'documentationUrl': 'https://cloud.ibm.com/docs/service-{0}'.format(s),
+                    'serviceKeysSupported': True,
+                },
+                'plans': [
+                    {
+                        'id': 'plan-{0:04d}-{1}'.format(s, p),
+                        'name': 'plan-{0}'.format(p),
+                        'description': 'Plan {0} of service {1}.'.format(p, s),
+                        'free': p == 0,
+                        'metadata': {
+                            'bullets': ['{0} GB storage'.format(10 * (p + 1)), 'Daily backups', '99.9% SLA'],
+                            'costs': [{'amount': {'usd': 12.5 * p}, 'unit': 'MONTHLY'}],
+                            'displayName': 'Plan {0}'.format(p),
+                        },
+                    }
+                    for p in range(plans)
+                ],
+            }
+            for s in range(services)
+        ]
+    }
+
+
+def bench(label: str, func, number: int) -> dict:
+    results = {}
+    for backend in sorted(JSON_BACKENDS):
+        set_json_backend(backend)
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        results[backend] = best / number * 1e6
+    line = '{0:<28}'.format(label) + ''.join(
+        '{0:>10}: {1:9.2f} us'.format(backend, usec) for backend, usec in sorted(results.items())
+    )
+    if 'orjson' in results:
+        line += '   x{0:.1f}'.format(results['stdlib'] / results['orjson'])
+    print(line)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', 1)[0])
+    parser.add_argument('--services', type=int, default=40)
+    parser.add_argument('--plans', type=int, default=6)
+    args = parser.parse_args()
+
+    body = provision_body()
+    catalog_dict = catalog(args.services, args.plans)
+    catalog_bytes = json_dumps_bytes(catalog_dict)
+    model = Resp1874650Root.from_dict(catalog(2, 2))
+    print('backends: {0}; catalog: {1} bytes'.format(', '.join(sorted(JSON_BACKENDS)), len(catalog_bytes)))
+
+    bench('provision body dumps', lambda: json_dumps(body), 20000)
+    bench('model __str__', lambda: str(model), 2000)
+    bench('catalog response render', lambda: json_dumps_bytes(catalog_dict), 200)
+    bench('catalog response decode', lambda: json_loads(catalog_bytes), 200)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,6 @@ the Resource Controller provisioning model.
 """
 
 from typing import Dict, List
-import json
 from dotenv import load_dotenv
 import os
 
@@ -34,7 +33,8 @@ from ibm_cloud_sdk_core.authenticators.authenticator import Authenticator
 from ibm_cloud_sdk_core.get_authenticator import get_authenticator_from_environment
 from ibm_cloud_sdk_core.utils import convert_model
 
-from common import get_sdk_headers
+from common import OPERATIONS, json_dumps
+from deadline import current_deadline
 
 ##############################################################################
 # Service
@@ -74,6 +74,17 @@ class OpenServiceBrokerV1(BaseService):
         """
         BaseService.__init__(self, service_url=self.DEFAULT_SERVICE_URL, authenticator=authenticator)
 
+    def send(self, request, **kwargs) -> DetailedResponse:
+        """
+        Send a request, with connect / read timeouts taken from the current deadline.
+
+        :raises DeadlineExceeded: Too little of the request deadline is left to call upstream.
+        """
+        deadline = current_deadline()
+        if deadline is not None and 'timeout' not in kwargs:
+            kwargs['timeout'] = deadline.timeouts()
+        return super().send(request, **kwargs)
+
     #########################
     # Enable and Disable Instances
     #########################
@@ -102,21 +113,10 @@ class OpenServiceBrokerV1(BaseService):
 
         if instance_id is None:
             raise ValueError('instance_id must be provided')
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='get_service_instance_state'
-        )
-        headers.update(sdk_headers)
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['instance_id']
-        path_param_values = self.encode_path_vars(instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/bluemix_v1/service_instances/{instance_id}'.format(**path_param_dict)
-        request = self.prepare_request(method='GET', url=url, headers=headers)
+        template = OPERATIONS['get_service_instance_state']
+        headers = template.headers(kwargs.get('headers'))
+        url = template.url(instance_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers)
 
         response = self.send(request)
         return response
@@ -164,26 +164,11 @@ class OpenServiceBrokerV1(BaseService):
 
         if instance_id is None:
             raise ValueError('instance_id must be provided')
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='replace_service_instance_state'
-        )
-        headers.update(sdk_headers)
-
-        data = {'enabled': enabled, 'initiator_id': initiator_id, 'reason_code': reason_code}
-        data = {k: v for (k, v) in data.items() if v is not None}
-        data = json.dumps(data)
-        headers['content-type'] = 'application/json'
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['instance_id']
-        path_param_values = self.encode_path_vars(instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/bluemix_v1/service_instances/{instance_id}'.format(**path_param_dict)
-        request = self.prepare_request(method='PUT', url=url, headers=headers, data=data)
+        template = OPERATIONS['replace_service_instance_state']
+        headers = template.headers(kwargs.get('headers'))
+        data = template.body(enabled, initiator_id, reason_code)
+        url = template.url(instance_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers, data=data)
 
         response = self.send(request)
         return response
@@ -266,35 +251,12 @@ class OpenServiceBrokerV1(BaseService):
             raise ValueError('instance_id must be provided')
         if context is not None:
             context = convert_model(context)
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='replace_service_instance'
-        )
-        headers.update(sdk_headers)
-
-        params = {'accepts_incomplete': accepts_incomplete}
-
-        data = {
-            'organization_guid': organization_guid,
-            'plan_id': plan_id,
-            'service_id': service_id,
-            'space_guid': space_guid,
-            'context': context,
-            'parameters': parameters,
-        }
-        data = {k: v for (k, v) in data.items() if v is not None}
-        data = json.dumps(data)
-        headers['content-type'] = 'application/json'
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['instance_id']
-        path_param_values = self.encode_path_vars(instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/v2/service_instances/{instance_id}'.format(**path_param_dict)
-        request = self.prepare_request(method='PUT', url=url, headers=headers, params=params, data=data)
+        template = OPERATIONS['replace_service_instance']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(accepts_incomplete)
+        data = template.body(organization_guid, plan_id, service_id, space_guid, context, parameters)
+        url = template.url(instance_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers, params=params, data=data)
 
         response = self.send(request)
         return response
@@ -358,34 +320,12 @@ class OpenServiceBrokerV1(BaseService):
             raise ValueError('instance_id must be provided')
         if context is not None:
             context = convert_model(context)
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='update_service_instance'
-        )
-        headers.update(sdk_headers)
-
-        params = {'accepts_incomplete': accepts_incomplete}
-
-        data = {
-            'service_id': service_id,
-            'context': context,
-            'parameters': parameters,
-            'plan_id': plan_id,
-            'previous_values': previous_values,
-        }
-        data = {k: v for (k, v) in data.items() if v is not None}
-        data = json.dumps(data)
-        headers['content-type'] = 'application/json'
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['instance_id']
-        path_param_values = self.encode_path_vars(instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/v2/service_instances/{instance_id}'.format(**path_param_dict)
-        request = self.prepare_request(method='PATCH', url=url, headers=headers, params=params, data=data)
+        template = OPERATIONS['update_service_instance']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(accepts_incomplete)
+        data = template.body(service_id, context, parameters, plan_id, previous_values)
+        url = template.url(instance_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers, params=params, data=data)
 
         response = self.send(request)
         return response
@@ -425,23 +365,11 @@ class OpenServiceBrokerV1(BaseService):
             raise ValueError('plan_id must be provided')
         if instance_id is None:
             raise ValueError('instance_id must be provided')
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='delete_service_instance'
-        )
-        headers.update(sdk_headers)
-
-        params = {'service_id': service_id, 'plan_id': plan_id, 'accepts_incomplete': accepts_incomplete}
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['instance_id']
-        path_param_values = self.encode_path_vars(instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/v2/service_instances/{instance_id}'.format(**path_param_dict)
-        request = self.prepare_request(method='DELETE', url=url, headers=headers, params=params)
+        template = OPERATIONS['delete_service_instance']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(service_id, plan_id, accepts_incomplete)
+        url = template.url(instance_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers, params=params)
 
         response = self.send(request)
         return response
@@ -471,18 +399,10 @@ class OpenServiceBrokerV1(BaseService):
         :rtype: DetailedResponse with `dict` result representing a `Resp1874650Root` object
         """
 
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='list_catalog'
-        )
-        headers.update(sdk_headers)
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        url = '/v2/catalog'
-        request = self.prepare_request(method='GET', url=url, headers=headers)
+        template = OPERATIONS['list_catalog']
+        headers = template.headers(kwargs.get('headers'))
+        url = template.path
+        request = self.prepare_request(method=template.method, url=url, headers=headers)
 
         response = self.send(request)
         return response
@@ -527,23 +447,11 @@ class OpenServiceBrokerV1(BaseService):
 
         if instance_id is None:
             raise ValueError('instance_id must be provided')
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='get_last_operation'
-        )
-        headers.update(sdk_headers)
-
-        params = {'operation': operation, 'plan_id': plan_id, 'service_id': service_id}
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['instance_id']
-        path_param_values = self.encode_path_vars(instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/v2/service_instances/{instance_id}/last_operation'.format(**path_param_dict)
-        request = self.prepare_request(method='GET', url=url, headers=headers, params=params)
+        template = OPERATIONS['get_last_operation']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(operation, plan_id, service_id)
+        url = template.url(instance_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers, params=params)
 
         response = self.send(request)
         return response
@@ -603,26 +511,11 @@ class OpenServiceBrokerV1(BaseService):
             raise ValueError('instance_id must be provided')
         if bind_resource is not None:
             bind_resource = convert_model(bind_resource)
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='replace_service_binding'
-        )
-        headers.update(sdk_headers)
-
-        data = {'plan_id': plan_id, 'service_id': service_id, 'bind_resource': bind_resource, 'parameters': parameters}
-        data = {k: v for (k, v) in data.items() if v is not None}
-        data = json.dumps(data)
-        headers['content-type'] = 'application/json'
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['binding_id', 'instance_id']
-        path_param_values = self.encode_path_vars(binding_id, instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/v2/service_instances/{instance_id}/service_bindings/{binding_id}'.format(**path_param_dict)
-        request = self.prepare_request(method='PUT', url=url, headers=headers, data=data)
+        template = OPERATIONS['replace_service_binding']
+        headers = template.headers(kwargs.get('headers'))
+        data = template.body(plan_id, service_id, bind_resource, parameters)
+        url = template.url(instance_id, binding_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers, data=data)
 
         response = self.send(request)
         return response
@@ -662,23 +555,11 @@ class OpenServiceBrokerV1(BaseService):
             raise ValueError('plan_id must be provided')
         if service_id is None:
             raise ValueError('service_id must be provided')
-        headers = {}
-        sdk_headers = get_sdk_headers(
-            service_name=self.DEFAULT_SERVICE_NAME, service_version='V1', operation_id='delete_service_binding'
-        )
-        headers.update(sdk_headers)
-
-        params = {'plan_id': plan_id, 'service_id': service_id}
-
-        if 'headers' in kwargs:
-            headers.update(kwargs.get('headers'))
-        headers['Accept'] = 'application/json'
-
-        path_param_keys = ['binding_id', 'instance_id']
-        path_param_values = self.encode_path_vars(binding_id, instance_id)
-        path_param_dict = dict(zip(path_param_keys, path_param_values))
-        url = '/v2/service_instances/{instance_id}/service_bindings/{binding_id}'.format(**path_param_dict)
-        request = self.prepare_request(method='DELETE', url=url, headers=headers, params=params)
+        template = OPERATIONS['delete_service_binding']
+        headers = template.headers(kwargs.get('headers'))
+        params = template.query(plan_id, service_id)
+        url = template.url(instance_id, binding_id)
+        request = self.prepare_request(method=template.method, url=url, headers=headers, params=params)
 
         response = self.send(request)
         return response
@@ -756,7 +637,7 @@ class Resp1874644Root:
 
     def __str__(self) -> str:
         """Return a `str` version of this Resp1874644Root object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Resp1874644Root') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -810,7 +691,7 @@ class Resp1874650Root:
 
     def __str__(self) -> str:
         """Return a `str` version of this Resp1874650Root object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Resp1874650Root') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -891,7 +772,7 @@ class Resp2079872Root:
 
     def __str__(self) -> str:
         """Return a `str` version of this Resp2079872Root object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Resp2079872Root') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -955,7 +836,7 @@ class Resp2079874Root:
 
     def __str__(self) -> str:
         """Return a `str` version of this Resp2079874Root object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Resp2079874Root') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1055,7 +936,7 @@ class Resp2079876Root:
 
     def __str__(self) -> str:
         """Return a `str` version of this Resp2079876Root object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Resp2079876Root') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1128,7 +1009,7 @@ class Resp2079894Root:
 
     def __str__(self) -> str:
         """Return a `str` version of this Resp2079894Root object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Resp2079894Root') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1208,7 +1089,7 @@ class Resp2448145Root:
 
     def __str__(self) -> str:
         """Return a `str` version of this Resp2448145Root object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Resp2448145Root') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1303,7 +1184,7 @@ class BindResource:
 
     def __str__(self) -> str:
         """Return a `str` version of this BindResource object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'BindResource') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1390,7 +1271,7 @@ class Context:
 
     def __str__(self) -> str:
         """Return a `str` version of this Context object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Context') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1493,7 +1374,7 @@ class Plans:
 
     def __str__(self) -> str:
         """Return a `str` version of this Plans object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Plans') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1658,7 +1539,7 @@ class Services:
 
     def __str__(self) -> str:
         """Return a `str` version of this Services object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'Services') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
@@ -1763,7 +1644,7 @@ class VolumeMount:
 
     def __str__(self) -> str:
         """Return a `str` version of this VolumeMount object."""
-        return json.dumps(self.to_dict(), indent=2)
+        return json_dumps(self.to_dict(), indent=2)
 
     def __eq__(self, other: 'VolumeMount') -> bool:
         """Return `true` when self and other are equal, false otherwise."""
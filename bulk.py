@@ -0,0 +1,170 @@
+# coding: utf-8
+
+"""
+Bounded concurrent fan-out for the bulk endpoints.
+
+`fan_out` runs a handler over the items of a bulk request with at most
+`concurrency` handlers in flight, and yields each item result as soon as it
+completes, followed by a summary line. Items are read lazily from the request
+(`iter_ndjson` / `iter_json_array`): NDJSON lines are decoded one at a time, as
+the fan-out makes room for them, rather than all up front.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable
+
+from common import json_dumps_bytes, json_loads
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_MAX_ITEMS = 10000
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+_DONE = object()
+
+
+class BulkInputError(Exception):
+    """The body of a bulk request cannot be read as NDJSON or as a json array."""
+
+
+async def iter_ndjson(body: bytes) -> AsyncIterator[Any]:
+    """Yield the json value of each non-blank line of an NDJSON body."""
+    start = 0
+    while start < len(body):
+        end = body.find(b'\n', start)
+        if end == -1:
+            end = len(body)
+        line = body[start:end]
+        start = end + 1
+        if line.strip():
+            yield _loads_line(line)
+
+
+def _loads_line(line: bytes) -> Any:
+    try:
+        return json_loads(line)
+    except ValueError as e:
+        raise BulkInputError('Invalid NDJSON line: {0}'.format(e)) from e
+
+
+async def iter_json_array(body: bytes) -> AsyncIterator[Any]:
+    """Yield the elements of a json array body."""
+    try:
+        items = json_loads(body)
+    except ValueError as e:
+        raise BulkInputError('Invalid json body: {0}'.format(e)) from e
+    if not isinstance(items, list):
+        raise BulkInputError('The body must be a json array or NDJSON')
+    for item in items:
+        yield item
+
+
+async def iter_list(items: Iterable[Any]) -> AsyncIterator[Any]:
+    """Yield the elements of an already decoded list of items."""
+    for item in items:
+        yield item
+
+
+def iter_items(content_type: str, body: bytes) -> AsyncIterator[Any]:
+    """Pick the NDJSON or json array reader for a request `Content-Type`."""
+    if (content_type or '').split(';')[0].strip().lower() in (NDJSON_MEDIA_TYPE, 'application/ndjson'):
+        return iter_ndjson(body)
+    return iter_json_array(body)
+
+
+class BulkSummary:
+    """Counters of the items of one bulk request."""
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.by_status: Dict[str, int] = {}
+
+    def add(self, result: Dict) -> None:
+        status_code = result.get('status_code', 500)
+        self.total += 1
+        if 200 <= status_code <= 299:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        key = str(status_code)
+        self.by_status[key] = self.by_status.get(key, 0) + 1
+
+    def to_dict(self) -> Dict:
+        return {'total': self.total, 'succeeded': self.succeeded, 'failed': self.failed, 'by_status': self.by_status}
+
+
+async def fan_out(
+    items: AsyncIterator[Any],
+    handler: Callable[[int, Any], Awaitable[Dict]],
+    *,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_items: int = DEFAULT_MAX_ITEMS,
+) -> AsyncIterator[Dict]:
+    """
+    Run `handler(index, item)` over `items` and yield the results as they complete.
+
+    The last value yielded is `{'summary': {...}}`. Handler exceptions become a
+    500 result for their item; an unreadable body or more than `max_items` items
+    stop reading the input and are reported as an `error` line before the summary.
+
+    :param items: The items of the request.
+    :param handler: Coroutine function returning the result dict of one item,
+           with at least `status_code`.
+    :param int concurrency: Upper bound of handlers in flight.
+    :param int max_items: Upper bound of items read from the request.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+    tasks = set()
+    summary = BulkSummary()
+
+    async def run(index: int, item: Any) -> None:
+        try:
+            result = await handler(index, item)
+        except Exception as e:  # pylint: disable=broad-except
+            result = {'index': index, 'status_code': 500, 'error': str(e)}
+        finally:
+            semaphore.release()
+        await results.put(result)
+
+    async def produce() -> None:
+        index = 0
+        try:
+            async for item in items:
+                if index >= max_items:
+                    raise BulkInputError('Too many items, the limit is {0}'.format(max_items))
+                await semaphore.acquire()
+                task = asyncio.ensure_future(run(index, item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+        except BulkInputError as e:
+            await results.put({'error': str(e)})
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await results.put(_DONE)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            result = await results.get()
+            if result is _DONE:
+                break
+            if 'status_code' in result:
+                summary.add(result)
+            yield result
+        yield {'summary': summary.to_dict()}
+    finally:
+        # Client gone: stop reading the input and abandon the items in flight
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+async def ndjson_lines(results: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    """Encode each result as one NDJSON line."""
+    async for result in results:
+        yield json_dumps_bytes(result) + b'\n'
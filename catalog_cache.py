@@ -0,0 +1,336 @@
+# coding: utf-8
+
+"""
+In-process TTL cache for the broker catalog.
+
+`CatalogCache` serves the catalog from memory, refreshes it in the background
+before it expires, keeps serving the previous copy while a refresh is running
+(stale-while-revalidate) and falls back to it when the upstream broker fails
+(stale-if-error). Alongside the decoded catalog it keeps an `EncodedCatalog`:
+the serialized response body and its compressed variants, rebuilt only when the
+catalog changes, together with a `CatalogIndex` for local validation. With a
+`SharedCatalogSnapshot`, only the worker holding the publisher lock fetches from
+upstream; the others load the published snapshot.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from catalog_index import CatalogIndex
+from common import json_dumps_bytes, json_loads
+from catalog_snapshot import SharedCatalogSnapshot, Snapshot
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300.0
+DEFAULT_REFRESH_AHEAD = 0.8
+DEFAULT_STALE_WHILE_REVALIDATE = 60.0
+DEFAULT_STALE_IF_ERROR = 3600.0
+DEFAULT_RETRY_INTERVAL = 5.0
+
+
+class EncodedCatalog:
+    """
+    A catalog serialized once into response bytes.
+
+    The variants are `bytes`, or `memoryview` slices of the shared snapshot when
+    loaded from it (`from_snapshot`).
+
+    :attr bytes body: The JSON response body.
+    :attr bytes gzip: The body compressed with gzip.
+    :attr bytes br: (optional) The body compressed with brotli, when available.
+    :attr str etag: Strong entity tag of the body.
+    :attr int service_count: Number of services in the catalog.
+    """
+
+    def __init__(self, body: bytes, service_count: int) -> None:
+        self.body = body
+        self.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+        self.br = brotli.compress(body) if brotli is not None else None
+        self.etag = '"{0}"'.format(hashlib.sha256(body).hexdigest()[:32])
+        self.service_count = service_count
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot, service_count: int) -> 'EncodedCatalog':
+        """Initialize an EncodedCatalog from the variants published in a shared snapshot, without copying them."""
+        encoded = cls.__new__(cls)
+        encoded.body = snapshot.body
+        encoded.gzip = snapshot.gzip
+        encoded.br = snapshot.br
+        encoded.etag = '"{0}"'.format(snapshot.etag)
+        encoded.service_count = service_count
+        return encoded
+
+    @classmethod
+    def from_catalog(cls, catalog: Dict) -> 'EncodedCatalog':
+        """Initialize an EncodedCatalog from a decoded catalog."""
+        return cls(serialize_catalog(catalog), len(catalog.get('services') or []))
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Return the best variant for an `Accept-Encoding` header and its content coding."""
+        accepted = _parse_accept_encoding(accept_encoding)
+        if self.br is not None and accepted.get('br', accepted.get('*', 0)) > 0:
+            return self.br, 'br'
+        if accepted.get('gzip', accepted.get('*', 0)) > 0:
+            return self.gzip, 'gzip'
+        return self.body, None
+
+
+def serialize_catalog(catalog: Dict) -> bytes:
+    """Serialize `catalog` to compact UTF-8 json, as the API's default response class does."""
+    return json_dumps_bytes(catalog)
+
+
+def _parse_accept_encoding(value: Optional[str]) -> Dict[str, float]:
+    accepted = {}
+    for item in (value or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+class CatalogCache:
+    """Catalog cache with background refresh, stale-while-revalidate and stale-if-error."""
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[Dict]],
+        *,
+        ttl: float = DEFAULT_TTL,
+        refresh_ahead: float = DEFAULT_REFRESH_AHEAD,
+        stale_while_revalidate: float = DEFAULT_STALE_WHILE_REVALIDATE,
+        stale_if_error: float = DEFAULT_STALE_IF_ERROR,
+        retry_interval: float = DEFAULT_RETRY_INTERVAL,
+        shared_snapshot: SharedCatalogSnapshot = None,
+    ) -> None:
+        """
+        Initialize a CatalogCache.
+
+        :param fetch: Coroutine function returning the catalog from upstream.
+        :param float ttl: Seconds a fetched catalog is considered fresh.
+        :param float refresh_ahead: Fraction of `ttl` after which the background
+               task refreshes the catalog, so it is replaced before it expires.
+        :param float stale_while_revalidate: Seconds past `ttl` during which the
+               expired catalog is still served while a refresh runs.
+        :param float stale_if_error: Seconds past `ttl` during which the expired
+               catalog is served when the refresh fails.
+        :param float retry_interval: Delay before the background task retries a
+               failed refresh, or polls the shared snapshot for a newer version.
+        :param SharedCatalogSnapshot shared_snapshot: (optional) Snapshot shared with
+               the other workers of the host.
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.retry_interval = retry_interval
+        self.shared_snapshot = shared_snapshot
+        self._snapshot_version: Optional[int] = None
+        self._catalog: Optional[Dict] = None
+        self._encoded: Optional[EncodedCatalog] = None
+        self.index: Optional[CatalogIndex] = None
+        self._fetched_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.encodings = 0
+        self.last_error: Optional[str] = None
+
+    def age(self) -> Optional[float]:
+        """Return the age of the cached catalog in seconds, or `None` if empty."""
+        if self._catalog is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    async def get(self) -> Dict:
+        """Return the catalog, fetching it from upstream only when no usable copy is cached."""
+        age = self.age()
+        if age is None:
+            self.misses += 1
+            return await self.refresh()
+
+        if age < self.ttl:
+            self.hits += 1
+            if age >= self.ttl * self.refresh_ahead:
+                self._refresh_in_background()
+            return self._catalog
+
+        if age < self.ttl + self.stale_while_revalidate:
+            self.stale_served += 1
+            self._refresh_in_background()
+            return self._catalog
+
+        self.misses += 1
+        try:
+            return await self.refresh()
+        except Exception:
+            if age < self.ttl + self.stale_if_error:
+                self.stale_served += 1
+                return self._catalog
+            raise
+
+    async def get_encoded(self) -> EncodedCatalog:
+        """Return the pre-encoded catalog, with the same freshness rules as `get`."""
+        await self.get()
+        return self._encoded
+
+    async def refresh(self) -> Dict:
+        """Fetch the catalog from upstream; concurrent callers share one fetch."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self) -> Dict:
+        try:
+            if self._is_follower() and self._load_snapshot():
+                return self._catalog
+            catalog = await self.fetch()
+        except Exception as e:
+            self.refresh_failures += 1
+            self.last_error = str(e)
+            raise
+        finally:
+            self._refresh_task = None
+        self.store(catalog)
+        if self.shared_snapshot is not None and self.shared_snapshot.is_publisher:
+            encoded = self._encoded
+            self._snapshot_version = self.shared_snapshot.publish(
+                encoded.body, gzip=encoded.gzip, br=encoded.br, etag=encoded.etag.strip('"')
+            )
+        return catalog
+
+    def _is_follower(self) -> bool:
+        return self.shared_snapshot is not None and not self.shared_snapshot.try_become_publisher()
+
+    def _load_snapshot(self) -> bool:
+        """
+        Load the shared snapshot if it is still fresh; decode it only when its version changed.
+
+        The published body and variants are served from the mapping as they are: only
+        the decoded catalog (for `get` and the index) is built in this worker.
+        """
+        snapshot = self.shared_snapshot.read()
+        if snapshot is None or snapshot.age() >= self.ttl:
+            return False
+        if snapshot.version != self._snapshot_version:
+            catalog = json_loads(snapshot.body)
+            self.store(catalog, encoded=EncodedCatalog.from_snapshot(snapshot, len(catalog.get('services') or [])))
+            self._snapshot_version = snapshot.version
+        self._fetched_at = time.monotonic() - snapshot.age()
+        self.last_error = None
+        return True
+
+    def store(self, catalog: Dict, *, encoded: EncodedCatalog = None) -> None:
+        """Replace the cached catalog, re-encoding it only if its content changed (or taking `encoded` as is)."""
+        if encoded is not None:
+            changed = self._encoded is None or encoded.etag != self._encoded.etag
+            self._encoded = encoded
+        else:
+            body = serialize_catalog(catalog)
+            changed = self._encoded is None or body != self._encoded.body
+            if changed:
+                self._encoded = EncodedCatalog(body, len(catalog.get('services') or []))
+                self.encodings += 1
+        if changed:
+            try:
+                self.index = CatalogIndex.from_catalog(catalog)
+            except (ValueError, TypeError) as e:
+                logger.warning('Catalog could not be indexed: %s', e)
+                self.index = None
+        self._catalog = catalog
+        self._fetched_at = time.monotonic()
+        self.refreshes += 1
+        self.last_error = None
+
+    def _refresh_in_background(self) -> None:
+        if self._refresh_task is not None:
+            return
+        task = asyncio.ensure_future(self.refresh())
+        task.add_done_callback(_log_refresh_failure)
+
+    def _next_refresh_delay(self) -> float:
+        age = self.age()
+        if age is None:
+            return self.retry_interval if self.refresh_failures else 0.0
+        if self.last_error is not None:
+            return self.retry_interval
+        delay = self.ttl * self.refresh_ahead - age
+        if delay <= 0 and self.shared_snapshot is not None and not self.shared_snapshot.is_publisher:
+            # Waiting for the publisher to replace a snapshot that is due.
+            return self.retry_interval
+        return max(delay, 0.0)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._next_refresh_delay())
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Catalog refresh failed: %s', e)
+
+    def start(self) -> None:
+        """Start the background task that refreshes the catalog before it expires."""
+        if self._background_task is None:
+            self._background_task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background refresh task."""
+        if self._background_task is not None:
+            self._background_task.cancel()
+            try:
+                await self._background_task
+            except asyncio.CancelledError:
+                pass
+            self._background_task = None
+        if self.shared_snapshot is not None:
+            self.shared_snapshot.release()
+
+    def snapshot(self) -> Dict:
+        """Return the cache counters as a json dictionary."""
+        return {
+            'age': self.age(),
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_served': self.stale_served,
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+            'encodings': self.encodings,
+            'last_error': self.last_error,
+            'shared_snapshot': None if self.shared_snapshot is None else {
+                'publisher': self.shared_snapshot.is_publisher,
+                'version': self._snapshot_version,
+                'publications': self.shared_snapshot.publications,
+                'reloads': self.shared_snapshot.reloads,
+            },
+        }
+
+
+def _log_refresh_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning('Background catalog refresh failed: %s', task.exception())
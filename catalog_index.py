@@ -0,0 +1,66 @@
+# coding: utf-8
+
+"""
+In-memory index of the broker catalog.
+
+`CatalogIndex` is built from the `Resp1874650Root` / `Services` / `Plans` catalog
+models and answers service and plan lookups in O(1), so requests with unknown
+`service_id` / `plan_id` values or unsupported plan changes can be rejected locally
+instead of after an upstream round trip.
+"""
+
+from typing import Dict, Optional, Tuple
+
+from broker_sdk import Plans, Resp1874650Root, Services
+
+
+class CatalogIndex:
+    """Lookup tables of the services and plans in a catalog."""
+
+    def __init__(self, services: Dict[str, Services], plans: Dict[Tuple[str, str], Plans]) -> None:
+        self.services = services
+        self.plans = plans
+
+    @classmethod
+    def from_catalog(cls, catalog: Dict) -> 'CatalogIndex':
+        """Build the index from a catalog json dictionary."""
+        root = Resp1874650Root.from_dict(catalog)
+        services = {}
+        plans = {}
+        for service in root.services or []:
+            services[service.id] = service
+            for plan in service.plans:
+                plans[(service.id, plan.id)] = plan
+        return cls(services, plans)
+
+    def service(self, service_id: str) -> Optional[Services]:
+        """Return the service with `service_id`, or `None`."""
+        return self.services.get(service_id)
+
+    def plan(self, service_id: str, plan_id: str) -> Optional[Plans]:
+        """Return the plan `plan_id` of service `service_id`, or `None`."""
+        return self.plans.get((service_id, plan_id))
+
+    def is_bindable(self, service_id: str) -> bool:
+        """Return `True` if instances of `service_id` can be bound."""
+        service = self.services.get(service_id)
+        return bool(service is not None and service.bindable)
+
+    def is_plan_updateable(self, service_id: str) -> bool:
+        """Return `True` if `service_id` supports plan changes (defaults to false)."""
+        service = self.services.get(service_id)
+        return bool(service is not None and service.plan_updateable)
+
+    def validate_plan(self, service_id: str, plan_id: str) -> Optional[str]:
+        """Return an error message if `service_id` / `plan_id` are not in the catalog, else `None`."""
+        if service_id not in self.services:
+            return 'service_id {0} not found in catalog'.format(service_id)
+        if (service_id, plan_id) not in self.plans:
+            return 'plan_id {0} not found in catalog for service_id {1}'.format(plan_id, service_id)
+        return None
+
+    def validate_plan_change(self, service_id: str, plan_id: str, previous_plan_id: Optional[str]) -> Optional[str]:
+        """Return an error message if changing from `previous_plan_id` to `plan_id` is not supported, else `None`."""
+        if previous_plan_id is None or previous_plan_id == plan_id or self.is_plan_updateable(service_id):
+            return None
+        return 'service_id {0} does not support plan changes'.format(service_id)
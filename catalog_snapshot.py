@@ -0,0 +1,182 @@
+# coding: utf-8
+
+"""
+Catalog snapshot shared between the gunicorn workers of one host.
+
+One worker, elected by holding an exclusive lock on `<path>.lock`, publishes the
+catalog body to a versioned snapshot file. The other workers memory-map the file
+and only decode it when its version changes. The file is replaced atomically, so
+a reader's existing mapping always stays consistent.
+
+The publisher also writes the compressed variants of the body and its entity
+tag, so the other workers serve `memoryview` slices of the mapping as they are,
+without copying the body or compressing it again.
+
+File layout: a fixed header (magic, version, publication time, entity tag and the
+lengths of the body, gzip and brotli variants, -1 for a missing brotli variant)
+followed by the JSON body, the gzip variant and the brotli variant.
+"""
+
+import mmap
+import os
+import struct
+import time
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+MAGIC = b'OSBCAT02'
+HEADER = struct.Struct('<8sQd64sQQq')
+
+
+class Snapshot:
+    """
+    A published catalog snapshot.
+
+    :attr int version: Monotonic version assigned by the publisher.
+    :attr float published_at: Publication time, in seconds since the epoch.
+    :attr memoryview body: The JSON body, mapped from the snapshot file.
+    :attr memoryview gzip: The body compressed with gzip, mapped from the snapshot file.
+    :attr memoryview br: (optional) The body compressed with brotli, mapped from the snapshot file.
+    :attr str etag: Entity tag of the body, as published.
+    """
+
+    __slots__ = ('version', 'published_at', 'body', 'gzip', 'br', 'etag')
+
+    def __init__(
+        self,
+        version: int,
+        published_at: float,
+        body: memoryview,
+        gzip: memoryview,
+        br: Optional[memoryview],
+        etag: str,
+    ) -> None:
+        self.version = version
+        self.published_at = published_at
+        self.body = body
+        self.gzip = gzip
+        self.br = br
+        self.etag = etag
+
+    def age(self) -> float:
+        """Return the seconds elapsed since publication."""
+        return max(time.time() - self.published_at, 0.0)
+
+
+class SharedCatalogSnapshot:
+    """Publish and read the catalog through a memory-mapped snapshot file."""
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize a SharedCatalogSnapshot.
+
+        :param str path: Path of the snapshot file. The publisher lock is kept in
+               `path + '.lock'`.
+        """
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._lock_fd: Optional[int] = None
+        self._stat_key = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._snapshot: Optional[Snapshot] = None
+        self.publications = 0
+        self.reloads = 0
+
+    @property
+    def is_publisher(self) -> bool:
+        """Return `True` if this process holds the publisher lock."""
+        return self._lock_fd is not None or fcntl is None
+
+    def try_become_publisher(self) -> bool:
+        """Try to take the publisher lock without blocking; return whether this process holds it."""
+        if self.is_publisher:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def release(self) -> None:
+        """Give up the publisher lock and unmap the snapshot."""
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self._snapshot = None
+        self._stat_key = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+
+    def publish(self, body: bytes, *, gzip: bytes, br: Optional[bytes], etag: str) -> int:
+        """Atomically replace the snapshot with `body` and its encoded variants; return the new version."""
+        current = self.read()
+        version = (current.version if current is not None else 0) + 1
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(
+                HEADER.pack(
+                    MAGIC, version, time.time(), etag.encode('ascii'), len(body), len(gzip),
+                    len(br) if br is not None else -1,
+                )
+            )
+            f.write(body)
+            f.write(gzip)
+            if br is not None:
+                f.write(br)
+        os.replace(tmp_path, self.path)
+        self.publications += 1
+        return version
+
+    def read(self) -> Optional[Snapshot]:
+        """
+        Return the current snapshot, or `None` if none was published.
+
+        Costs one `stat` call when the file did not change since the last read.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        if _stat_key(stat) == self._stat_key:
+            return self._snapshot
+
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER.size:
+                return None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, published_at, etag, body_length, gzip_length, br_length = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or HEADER.size + body_length + gzip_length + max(br_length, 0) > len(mapped):
+            mapped.close()
+            return None
+
+        view = memoryview(mapped)
+        gzip_start = HEADER.size + body_length
+        br_start = gzip_start + gzip_length
+        self._snapshot = Snapshot(
+            version,
+            published_at,
+            view[HEADER.size:gzip_start],
+            view[gzip_start:br_start],
+            view[br_start:br_start + br_length] if br_length >= 0 else None,
+            etag.rstrip(b'\0').decode('ascii'),
+        )
+        self._mmap = mapped
+        self._stat_key = _stat_key(stat)
+        self.reloads += 1
+        return self._snapshot
+
+
+def _stat_key(stat: os.stat_result) -> tuple:
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
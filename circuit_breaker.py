@@ -0,0 +1,235 @@
+# coding: utf-8
+
+"""
+Per-operation circuit breakers in front of the upstream broker.
+
+Each group of SDK operations (catalog, provision, update, delete, last_operation,
+bindings, instance_state) has its own `CircuitBreaker`. A breaker watches the
+outcome of the last `window` calls and opens when too many of them failed (5xx
+responses, timeouts, transport errors) or were slow. While open, calls fail at
+once with `CircuitOpen` instead of waiting for a degraded upstream; after
+`open_duration` a few trial calls are let through (half-open) and decide whether
+the breaker closes again or stays open.
+
+`CircuitBreakingBroker` wraps a coroutine broker client (`AsyncOpenServiceBrokerV1`
+or `OffloadedOpenServiceBrokerV1`) so that every operation goes through its breaker.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict
+
+import httpx
+import requests
+from ibm_cloud_sdk_core import ApiException
+
+from deadline import DeadlineExceeded
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+OPERATION_GROUPS = {
+    'list_catalog': 'catalog',
+    'replace_service_instance': 'provision',
+    'update_service_instance': 'update',
+    'delete_service_instance': 'delete',
+    'get_last_operation': 'last_operation',
+    'replace_service_binding': 'bindings',
+    'delete_service_binding': 'bindings',
+    'get_service_instance_state': 'instance_state',
+    'replace_service_instance_state': 'instance_state',
+}
+
+
+class CircuitOpen(Exception):
+    """A call was rejected because the breaker of its operation is open."""
+
+    def __init__(self, operation: str, retry_after: float) -> None:
+        self.operation = operation
+        self.retry_after = retry_after
+        super().__init__('Upstream broker unavailable for {0}, circuit breaker open'.format(operation))
+
+
+def is_failure(error: BaseException) -> bool:
+    """Return `True` if `error` means upstream is unhealthy (as opposed to a rejected request)."""
+    if isinstance(error, ApiException):
+        return error.status_code >= 500
+    return isinstance(
+        error, (asyncio.TimeoutError, httpx.TransportError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    )
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a count-based sliding window of calls."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_call_duration: float = 5.0,
+        slow_call_rate: float = 0.8,
+        open_duration: float = 30.0,
+        half_open_calls: int = 3,
+    ) -> None:
+        """
+        Initialize a CircuitBreaker.
+
+        :param str name: The operation group guarded by the breaker.
+        :param int window: Number of most recent calls the rates are computed on.
+        :param int min_calls: Calls needed in the window before the breaker can open.
+        :param float failure_rate: Share of failed calls that opens the breaker.
+        :param float slow_call_duration: Seconds after which a call counts as slow.
+        :param float slow_call_rate: Share of slow calls that opens the breaker.
+        :param float open_duration: Seconds the breaker stays open before trial calls.
+        :param int half_open_calls: Trial calls that must all succeed to close again.
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._trials_started = 0
+        self._trials_succeeded = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        self._trials_started = 0
+        self._trials_succeeded = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+        elif state == CLOSED:
+            self._outcomes.clear()
+
+    def retry_after(self) -> float:
+        """Return the seconds left before the breaker lets trial calls through."""
+        return max(self._opened_at + self.open_duration - time.monotonic(), 0.0)
+
+    def before_call(self) -> None:
+        """Admit a call, or raise `CircuitOpen`."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                raise CircuitOpen(self.name, self.retry_after())
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._trials_started >= self.half_open_calls:
+                self.rejected += 1
+                raise CircuitOpen(self.name, 1.0)
+            self._trials_started += 1
+
+    def record(self, failed: bool, duration: float) -> None:
+        """Record the outcome of an admitted call."""
+        slow = duration >= self.slow_call_duration
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._transition(OPEN)
+                return
+            self._trials_succeeded += 1
+            if self._trials_succeeded >= self.half_open_calls:
+                self._transition(CLOSED)
+            return
+        self._outcomes.append((failed, slow))
+        if self.state == CLOSED and len(self._outcomes) >= self.min_calls:
+            failures, slow_calls = self._rates()
+            if failures >= self.failure_rate or slow_calls >= self.slow_call_rate:
+                self._transition(OPEN)
+
+    def release(self) -> None:
+        """Give back the trial slot of a call that ended without an outcome (cancelled, deadline)."""
+        if self.state == HALF_OPEN and self._trials_started > 0:
+            self._trials_started -= 1
+
+    def _rates(self):
+        calls = len(self._outcomes)
+        if not calls:
+            return 0.0, 0.0
+        return (
+            sum(1 for failed, _ in self._outcomes if failed) / calls,
+            sum(1 for _, slow in self._outcomes if slow) / calls,
+        )
+
+    async def call(self, func: Callable[[], Awaitable]):
+        """Run the coroutine function `func` through the breaker."""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = await func()
+        except (asyncio.CancelledError, DeadlineExceeded):
+            # Not sent, or abandoned: says nothing about the health of upstream
+            self.release()
+            raise
+        except Exception as e:
+            self.record(is_failure(e), time.monotonic() - start)
+            raise
+        self.record(False, time.monotonic() - start)
+        return result
+
+    def snapshot(self) -> Dict:
+        """Return the breaker state and counters as a json dictionary."""
+        failures, slow_calls = self._rates()
+        return {
+            'state': self.state,
+            'calls_in_window': len(self._outcomes),
+            'failure_rate': failures,
+            'slow_call_rate': slow_calls,
+            'rejected': self.rejected,
+            'times_opened': self.times_opened,
+            'retry_after': self.retry_after() if self.state == OPEN else None,
+        }
+
+
+class CircuitBreakerRegistry:
+    """One `CircuitBreaker` per operation group, created on first use."""
+
+    def __init__(self, **config) -> None:
+        """
+        Initialize a CircuitBreakerRegistry.
+
+        :param config: Keyword arguments of `CircuitBreaker`, applied to every breaker.
+        """
+        self.config = config
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        """Return the breaker of operation group `name`."""
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(name, **self.config)
+        return breaker
+
+    def snapshot(self) -> Dict:
+        """Return the state of every breaker as a json dictionary."""
+        return {name: breaker.snapshot() for name, breaker in sorted(self.breakers.items())}
+
+
+class CircuitBreakingBroker:
+    """Coroutine broker client whose operations go through per-operation circuit breakers."""
+
+    def __init__(self, service, breakers: CircuitBreakerRegistry) -> None:
+        self.service = service
+        self.breakers = breakers
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.service, name)
+        group = OPERATION_GROUPS.get(name)
+        if group is None:
+            return attribute
+        breaker = self.breakers.get(group)
+
+        async def call(*args, **kwargs):
+            return await breaker.call(lambda: attribute(*args, **kwargs))
+
+        return call
@@ -18,9 +18,18 @@
 This module provides common methods for use across all service modules.
 """
 
+import functools
+import json
 import platform
+from types import MappingProxyType
+from urllib.parse import quote
 from version import __version__
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 HEADER_NAME_USER_AGENT = 'User-Agent'
 SDK_NAME = 'platform-services-python-sdk'
 
@@ -54,3 +63,194 @@ def get_sdk_headers(service_name, service_version, operation_id):
     headers = {}
     headers[HEADER_NAME_USER_AGENT] = get_user_agent()
     return headers
+
+
+def _stdlib_dumps(obj, indent=None):
+    if indent is not None:
+        return json.dumps(obj, indent=indent, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _orjson_dumps(obj, indent=None):
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent is not None else 0)
+    except TypeError:
+        # Types orjson does not handle (e.g. non-str keys, very large ints)
+        return _stdlib_dumps(obj, indent)
+
+
+def _stdlib_loads(data):
+    # json.loads takes str / bytes only; orjson.loads also reads memoryviews in place
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+JSON_BACKENDS = {'stdlib': (_stdlib_dumps, _stdlib_loads)}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+_json_backend = 'orjson' if orjson is not None else 'stdlib'
+_dumps, _loads = JSON_BACKENDS[_json_backend]
+
+
+def set_json_backend(name):
+    """
+    Select the json serializer used by json_dumps / json_dumps_bytes / json_loads:
+    'orjson' (default when installed) or 'stdlib'.
+    """
+    global _json_backend, _dumps, _loads  # pylint: disable=global-statement
+    if name not in JSON_BACKENDS:
+        raise ValueError('json backend {0} is not available'.format(name))
+    _json_backend = name
+    _dumps, _loads = JSON_BACKENDS[name]
+
+
+def get_json_backend():
+    """
+    Get the name of the selected json serializer
+    """
+    return _json_backend
+
+
+def json_dumps_bytes(obj, indent=None):
+    """
+    Serialize obj to compact (or, with indent, indented) UTF-8 json bytes
+    """
+    return _dumps(obj, indent)
+
+
+def json_dumps(obj, indent=None):
+    """
+    Serialize obj to a json string
+    """
+    return _dumps(obj, indent).decode('utf-8')
+
+
+def json_loads(data):
+    """
+    Deserialize json from str, bytes or memoryview
+    """
+    return _loads(data)
+
+
+# Path values (instance and binding ids) repeat across calls, e.g. last_operation polling
+_quote_path_value = functools.lru_cache(maxsize=4096)(functools.partial(quote, safe=''))
+
+
+class OperationTemplate:
+    """
+    Request pieces of one service operation, compiled once at import: frozen
+    headers (SDK headers, content-type, Accept), a URL builder that only quotes
+    the path values, and the query / body encoders that drop None values.
+
+    The headers are shared read-only between calls: `prepare_request` copies them
+    into the request, so a call without headers of its own builds no header dict.
+    """
+
+    __slots__ = ('operation_id', 'method', 'path', 'query_keys', 'body_keys', '_base_headers', '_headers', '_segments')
+
+    def __init__(self, service_name, operation_id, method, path, query=(), body=(), content_type=None):
+        self.operation_id = operation_id
+        self.method = method
+        self.path = path
+        self.query_keys = tuple(query)
+        self.body_keys = tuple(body)
+        headers = dict(get_sdk_headers(service_name=service_name, service_version='V1', operation_id=operation_id))
+        if content_type is not None:
+            headers['content-type'] = content_type
+        self._base_headers = dict(headers)
+        headers['Accept'] = 'application/json'
+        self._headers = MappingProxyType(headers)
+        # '/a/{x}/b/{y}' -> (('/a/', 'x'), ('/b/', 'y'), ('', None))
+        segments = []
+        rest = path
+        while '{' in rest:
+            literal, _, rest = rest.partition('{')
+            name, _, rest = rest.partition('}')
+            segments.append((literal, name))
+        segments.append((rest, None))
+        self._segments = tuple(segments)
+
+    def headers(self, extra=None):
+        """
+        Get the request headers, with the caller's headers over the defaults and Accept last.
+        Without caller headers, the shared read-only mapping is returned
+        """
+        if not extra:
+            return self._headers
+        return {**self._base_headers, **extra, 'Accept': 'application/json'}
+
+    def url(self, *path_values):
+        """
+        Get the operation path with the path-encoded values of its parameters, given in path order
+        """
+        url = ''
+        for (literal, _), value in zip(self._segments, path_values):
+            url += literal + _quote_path_value(value)
+        return url + self._segments[-1][0]
+
+    def query(self, *values):
+        """
+        Get the query parameters, given in the order of query_keys, without the None ones
+        """
+        return {k: v for (k, v) in zip(self.query_keys, values) if v is not None}
+
+    def body(self, *values):
+        """
+        Get the json body, given in the order of body_keys, without the None fields
+        """
+        body = json_dumps_bytes({k: v for (k, v) in zip(self.body_keys, values) if v is not None})
+        # orjson writes into a buffer of at least 1 KiB that the bytes object keeps; copying the
+        # (small) body out of it frees the buffer before the request is prepared and sent
+        return memoryview(body).tobytes()
+
+
+# Request templates of the Open Service Broker operations, compiled once at import and
+# shared by the synchronous, packaged and async clients
+OPERATIONS = {
+    operation.operation_id: operation
+    for operation in (
+        OperationTemplate(
+            'open_service_broker', 'get_service_instance_state', 'GET', '/bluemix_v1/service_instances/{instance_id}',
+        ),
+        OperationTemplate(
+            'open_service_broker', 'replace_service_instance_state', 'PUT',
+            '/bluemix_v1/service_instances/{instance_id}',
+            body=('enabled', 'initiator_id', 'reason_code'),
+            content_type='application/json',
+        ),
+        OperationTemplate(
+            'open_service_broker', 'replace_service_instance', 'PUT', '/v2/service_instances/{instance_id}',
+            query=('accepts_incomplete',),
+            body=('organization_guid', 'plan_id', 'service_id', 'space_guid', 'context', 'parameters'),
+            content_type='application/json',
+        ),
+        OperationTemplate(
+            'open_service_broker', 'update_service_instance', 'PATCH', '/v2/service_instances/{instance_id}',
+            query=('accepts_incomplete',),
+            body=('service_id', 'context', 'parameters', 'plan_id', 'previous_values'),
+            content_type='application/json',
+        ),
+        OperationTemplate(
+            'open_service_broker', 'delete_service_instance', 'DELETE', '/v2/service_instances/{instance_id}',
+            query=('service_id', 'plan_id', 'accepts_incomplete'),
+        ),
+        OperationTemplate('open_service_broker', 'list_catalog', 'GET', '/v2/catalog'),
+        OperationTemplate(
+            'open_service_broker', 'get_last_operation', 'GET', '/v2/service_instances/{instance_id}/last_operation',
+            query=('operation', 'plan_id', 'service_id'),
+        ),
+        OperationTemplate(
+            'open_service_broker', 'replace_service_binding', 'PUT',
+            '/v2/service_instances/{instance_id}/service_bindings/{binding_id}',
+            body=('plan_id', 'service_id', 'bind_resource', 'parameters'),
+            content_type='application/json',
+        ),
+        OperationTemplate(
+            'open_service_broker', 'delete_service_binding', 'DELETE',
+            '/v2/service_instances/{instance_id}/service_bindings/{binding_id}',
+            query=('plan_id', 'service_id'),
+        ),
+    )
+}
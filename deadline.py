@@ -0,0 +1,148 @@
+# coding: utf-8
+
+"""
+Per-request deadlines propagated to the upstream calls.
+
+Every incoming request gets a `Deadline`: the time budget announced by the caller
+in the `X-Request-Timeout-Ms` header, capped by the default of its route. The
+deadline is stored in a context variable, so it follows the request into the
+async client, the offload threads of the synchronous SDK and the retries. Before
+each upstream attempt the remaining budget becomes the connect / read timeouts of
+the call; when less than `min_budget` is left the call is not sent at all and
+`DeadlineExceeded` is raised, so the request fails fast instead of holding a
+connection (or a worker thread) for an answer nobody will wait for.
+"""
+
+import contextvars
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+import requests
+
+DEFAULT_DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+DEFAULT_TIMEOUT = 55.0
+DEFAULT_CONNECT_TIMEOUT = 3.0
+DEFAULT_MIN_BUDGET = 0.5
+
+_current: contextvars.ContextVar = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request has too little time left to call upstream."""
+
+    def __init__(self, remaining: float) -> None:
+        self.remaining = remaining
+        super().__init__('Request deadline exceeded ({0:.3f}s left)'.format(max(remaining, 0.0)))
+
+
+class Deadline:
+    """The point in time by which the current request must be answered."""
+
+    def __init__(self, expires_at: float, policy: 'DeadlinePolicy') -> None:
+        self.expires_at = expires_at
+        self.policy = policy
+
+    def remaining(self) -> float:
+        """Return the seconds left before the deadline (negative once expired)."""
+        return self.expires_at - time.monotonic()
+
+    def check(self) -> float:
+        """Return the seconds left, or raise `DeadlineExceeded` if under the minimum budget."""
+        remaining = self.remaining()
+        if remaining < self.policy.min_budget:
+            self.policy.abandoned += 1
+            raise DeadlineExceeded(remaining)
+        return remaining
+
+    def timeouts(self) -> Tuple[float, float]:
+        """Return the `(connect, read)` timeouts of the next upstream attempt."""
+        remaining = self.check()
+        return min(self.policy.connect_timeout, remaining), remaining
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        """Return the timeouts of the next upstream attempt for the async client."""
+        connect, read = self.timeouts()
+        return httpx.Timeout(read, connect=connect)
+
+
+class DeadlinePolicy:
+    """Derives the deadline of each incoming request and counts the ones cut short."""
+
+    def __init__(
+        self,
+        *,
+        default: float = DEFAULT_TIMEOUT,
+        routes: Dict[str, float] = None,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        min_budget: float = DEFAULT_MIN_BUDGET,
+        header: str = DEFAULT_DEADLINE_HEADER,
+    ) -> None:
+        """
+        Initialize a DeadlinePolicy.
+
+        :param float default: Deadline, in seconds, of routes not in `routes`.
+        :param dict routes: (optional) Deadline in seconds keyed by route name.
+        :param float connect_timeout: Upper bound of the upstream connect timeout.
+        :param float min_budget: Remaining seconds under which upstream is not called.
+        :param str header: Request header carrying the caller's budget, in milliseconds.
+        """
+        self.default = default
+        self.routes = dict(routes or {})
+        self.connect_timeout = connect_timeout
+        self.min_budget = min_budget
+        self.header = header
+        self.rejected = 0
+        self.abandoned = 0
+
+    def deadline_for(self, route: Optional[str], header_value: Optional[str] = None) -> Deadline:
+        """Return the deadline of a request to `route` carrying `header_value`."""
+        timeout = self.routes.get(route, self.default)
+        if header_value:
+            try:
+                timeout = min(timeout, float(header_value) / 1000.0)
+            except ValueError:
+                pass
+        return Deadline(time.monotonic() + timeout, self)
+
+    def snapshot(self) -> Dict:
+        """Return the deadline settings and counters as a json dictionary."""
+        return {
+            'default': self.default,
+            'routes': self.routes,
+            'connect_timeout': self.connect_timeout,
+            'min_budget': self.min_budget,
+            'rejected': self.rejected,
+            'abandoned': self.abandoned,
+        }
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the request being handled, if any."""
+    return _current.get()
+
+
+def set_deadline(deadline: Optional[Deadline]) -> contextvars.Token:
+    """Make `deadline` the current one; pass the returned token to `reset_deadline`."""
+    return _current.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token) -> None:
+    """Restore the deadline that was current before `set_deadline`."""
+    _current.reset(token)
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Return `True` if `error` is an upstream timeout or an exceeded deadline."""
+    return isinstance(error, (DeadlineExceeded, httpx.TimeoutException, requests.exceptions.Timeout))
+
+
+def parse_route_timeouts(value: str) -> Dict[str, float]:
+    """Parse `route=seconds` pairs separated by commas, e.g. `catalog=10,last_operation=5`."""
+    routes = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        name, _, seconds = item.partition('=')
+        routes[name.strip()] = float(seconds)
+    return routes
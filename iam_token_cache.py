@@ -0,0 +1,187 @@
+# coding: utf-8
+
+"""
+IAM token manager shared by the workers of one host.
+
+`SharedIAMTokenManager` keeps the token of an `IAMAuthenticator` fresh from a
+background task, ahead of the SDK's own refresh time, so no request ever pays for
+an IAM round trip inline. The current token response is shared through a file
+guarded by an exclusive lock: the first worker to find the token due refreshes it,
+and the others adopt the token it wrote instead of exchanging the API key again.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_LEAD = 120.0
+DEFAULT_RETRY_INTERVAL = 10.0
+
+
+class SharedIAMTokenManager:
+    """Background, cross-worker refresh of an IAM authenticator's token."""
+
+    def __init__(
+        self,
+        authenticator,
+        *,
+        path: Optional[str] = None,
+        refresh_lead: float = DEFAULT_REFRESH_LEAD,
+        retry_interval: float = DEFAULT_RETRY_INTERVAL,
+    ) -> None:
+        """
+        Initialize a SharedIAMTokenManager.
+
+        :param IAMAuthenticator authenticator: The authenticator whose token is managed.
+        :param str path: (optional) File used to share the token between workers.
+               It holds a bearer token and is created readable by the owner only.
+               Without it each worker refreshes on its own, still in the background.
+        :param float refresh_lead: Seconds before the SDK refresh time at which
+               the token is refreshed.
+        :param float retry_interval: Delay before retrying a failed refresh.
+        """
+        self.token_manager = authenticator.token_manager
+        self.path = path
+        self.lock_path = path + '.lock' if path else None
+        self.refresh_lead = refresh_lead
+        self.retry_interval = retry_interval
+        self._fetched_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.adoptions = 0
+        self.failures = 0
+        self.last_refresh_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _due(self, margin: float) -> bool:
+        """Return `True` if the in-memory token must be refreshed within `margin` seconds."""
+        return self.token_manager.access_token is None or self.token_manager.refresh_time - margin <= time.time()
+
+    def ensure_fresh(self) -> None:
+        """
+        Make sure the token is valid and not due for refresh (blocking).
+
+        Adopts the shared token when another worker already refreshed it, and
+        otherwise exchanges the API key with IAM and publishes the new token.
+        """
+        if not self._due(self.refresh_lead):
+            return
+        lock_fd = self._lock()
+        try:
+            shared = self._read_shared()
+            if shared is not None and self._adopt(shared) and not self._due(self.refresh_lead):
+                self.adoptions += 1
+                return
+            start = time.monotonic()
+            token_response = self.token_manager.request_token()
+            self.last_refresh_latency = time.monotonic() - start
+            self.token_manager._save_token_info(token_response)
+            self._fetched_at = time.time()
+            self.refreshes += 1
+            self._write_shared(token_response)
+        finally:
+            self._unlock(lock_fd)
+
+    def _adopt(self, shared: Dict) -> bool:
+        token_response = shared.get('token_response') or {}
+        if token_response.get('access_token') in (None, self.token_manager.access_token):
+            return False
+        if self._fetched_at is not None and (shared.get('fetched_at') or 0) <= self._fetched_at:
+            return False
+        try:
+            self.token_manager._save_token_info(token_response)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning('Ignoring unreadable shared IAM token: %s', e)
+            return False
+        self._fetched_at = shared.get('fetched_at')
+        return True
+
+    def _lock(self) -> Optional[int]:
+        if not self.lock_path or fcntl is None:
+            return None
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    @staticmethod
+    def _unlock(fd: Optional[int]) -> None:
+        if fd is not None:
+            os.close(fd)
+
+    def _read_shared(self) -> Optional[Dict]:
+        if not self.path:
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_shared(self, token_response: Dict) -> None:
+        if not self.path:
+            return
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'fetched_at': self._fetched_at, 'token_response': token_response}, f)
+        os.replace(tmp_path, self.path)
+
+    def _next_refresh_delay(self) -> float:
+        if self.last_error is not None:
+            return self.retry_interval
+        return max(self.token_manager.refresh_time - self.refresh_lead - time.time(), 0.0)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._next_refresh_delay())
+            await self.refresh()
+
+    async def refresh(self) -> None:
+        """Run `ensure_fresh` on a worker thread, recording failures instead of raising them."""
+        try:
+            await asyncio.to_thread(self.ensure_fresh)
+            self.last_error = None
+        except Exception as e:  # pylint: disable=broad-except
+            self.failures += 1
+            self.last_error = str(e)
+            logger.warning('IAM token refresh failed: %s', e)
+
+    async def start(self) -> None:
+        """Load or fetch the first token, then keep it fresh in the background."""
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background refresh task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict:
+        """Return the token counters as a json dictionary."""
+        now = time.time()
+        has_token = self.token_manager.access_token is not None
+        return {
+            'token_age': now - self._fetched_at if self._fetched_at is not None else None,
+            'expires_in': self.token_manager.expire_time - now if has_token else None,
+            'refreshes': self.refreshes,
+            'adoptions': self.adoptions,
+            'failures': self.failures,
+            'last_refresh_latency': self.last_refresh_latency,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+"""
+Idempotency store for provision requests.
+
+The platform retries `PUT /v2/service_instances/{instance_id}` when it times out.
+`IdempotencyStore` records the response of each successful provision together
+with a fingerprint of its canonical request body, in a SQLite database shared by
+the workers of one host. A replay with the same body is answered from the store;
+a request with a different body for an instance that was already provisioned
+raises `IdempotencyConflict` (409 Conflict in OSB 2.12).
+
+Only completed provisions are recorded: a `202 Accepted` (asynchronous provision
+in progress) is not a final outcome, so a retry of it goes upstream again and
+gets the current answer (still 202, or the 200 once the operation finished).
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+DEFAULT_TTL = 86400.0
+DEFAULT_MAX_ENTRIES = 10000
+PRUNE_INTERVAL = 100
+ACCEPTED = 202
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS provisions ('
+    ' instance_id TEXT PRIMARY KEY,'
+    ' fingerprint TEXT NOT NULL,'
+    ' status_code INTEGER NOT NULL,'
+    ' body TEXT NOT NULL,'
+    ' stored_at REAL NOT NULL)'
+)
+
+
+class IdempotencyConflict(Exception):
+    """A provision request does not match the one already recorded for the instance."""
+
+    def __init__(self, instance_id: str) -> None:
+        self.instance_id = instance_id
+        super().__init__(
+            'Service instance {0} already exists with different attributes'.format(instance_id)
+        )
+
+
+def body_fingerprint(body: Dict) -> str:
+    """Return a hash of the canonical json form of a request body."""
+    canonical = json.dumps(body, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """Bounded, SQLite-backed record of the provision responses per instance."""
+
+    def __init__(self, path: str, *, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """
+        Initialize an IdempotencyStore.
+
+        :param str path: SQLite database file; use the same path in every worker.
+        :param float ttl: Seconds a provision response is replayed.
+        :param int max_entries: Number of instances kept before the oldest
+               records are pruned.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._stores_since_prune = 0
+        self.replays = 0
+        self.conflicts = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, instance_id: str, fingerprint: str) -> Optional[Tuple[int, Dict]]:
+        """
+        Return the recorded `(status_code, body)` of a replayed request, or `None` (blocking).
+
+        :raises IdempotencyConflict: if the instance was provisioned with another body.
+        """
+        row = self._connection().execute(
+            'SELECT fingerprint, status_code, body FROM provisions'
+            ' WHERE instance_id = ? AND stored_at > ? AND status_code != ?',
+            (instance_id, time.time() - self.ttl, ACCEPTED),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        if row[0] != fingerprint:
+            self.conflicts += 1
+            raise IdempotencyConflict(instance_id)
+        self.replays += 1
+        return row[1], json.loads(row[2])
+
+    def record(self, instance_id: str, fingerprint: str, status_code: int, body: Dict) -> None:
+        """Record the response of a completed provision; a 202 is not recorded (blocking)."""
+        if status_code == ACCEPTED:
+            self.forget(instance_id)
+            return
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO provisions (instance_id, fingerprint, status_code, body, stored_at)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (instance_id, fingerprint, status_code, json.dumps(body), time.time()),
+        )
+        self.stores += 1
+        self._stores_since_prune += 1
+        if self._stores_since_prune >= PRUNE_INTERVAL:
+            self._stores_since_prune = 0
+            self._prune(connection)
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        connection.execute('DELETE FROM provisions WHERE stored_at <= ?', (time.time() - self.ttl,))
+        connection.execute(
+            'DELETE FROM provisions WHERE instance_id IN ('
+            ' SELECT instance_id FROM provisions ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        )
+
+    def forget(self, instance_id: str) -> None:
+        """Drop the record of `instance_id`; call when it is updated or deprovisioned (blocking)."""
+        self._connection().execute('DELETE FROM provisions WHERE instance_id = ?', (instance_id,))
+
+    async def get(self, instance_id: str, fingerprint: str) -> Optional[Tuple[int, Dict]]:
+        """Run `lookup` on a worker thread."""
+        return await asyncio.to_thread(self.lookup, instance_id, fingerprint)
+
+    async def put(self, instance_id: str, fingerprint: str, status_code: int, body: Dict) -> None:
+        """Run `record` on a worker thread."""
+        await asyncio.to_thread(self.record, instance_id, fingerprint, status_code, body)
+
+    async def discard(self, instance_id: str) -> None:
+        """Run `forget` on a worker thread."""
+        await asyncio.to_thread(self.forget, instance_id)
+
+    def snapshot(self) -> Dict:
+        """Return the store counters as a json dictionary."""
+        return {
+            'replays': self.replays,
+            'conflicts': self.conflicts,
+            'misses': self.misses,
+            'stores': self.stores,
+            'ttl': self.ttl,
+            'max_entries': self.max_entries,
+        }
@@ -0,0 +1,80 @@
+# coding: utf-8
+
+"""
+Read-through cache of service instance enable/disable state.
+
+`InstanceStateCache.get` serves `/bluemix_v1/service_instances/{instance_id}`
+state from memory and falls back to upstream on a miss. `InstanceStateCache.replace`
+wraps a state change: the cached state is invalidated before the upstream write and
+replaced by the written state once it succeeds. Reads that overlap a write are never
+stored, so a read started before the write cannot bring back the old state.
+"""
+
+from typing import Awaitable, Callable, Dict
+
+from ttl_cache import DEFAULT_MAX_ENTRIES, TTLCache
+
+DEFAULT_TTL = 30.0
+
+
+class InstanceStateCache:
+    """Read-through, write-through cache of instance state keyed by instance_id."""
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Dict]],
+        *,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        """
+        Initialize an InstanceStateCache.
+
+        :param fetch: Coroutine function returning the upstream state of an instance.
+        :param float ttl: Seconds a state is served from the cache.
+        :param int max_entries: Number of instances kept before LRU eviction.
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self._states = TTLCache(max_entries=max_entries)
+        self._write_epoch = 0
+        self.writes = 0
+
+    async def get(self, instance_id: str) -> Dict:
+        """Return the state of `instance_id`, reading through to upstream on a miss."""
+        state = self._states.get(instance_id)
+        if state is not None:
+            return state
+        epoch = self._write_epoch
+        state = await self.fetch(instance_id)
+        if epoch == self._write_epoch:
+            self._states.set(instance_id, state, self.ttl)
+        return state
+
+    async def replace(self, instance_id: str, write: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Run the upstream state change `write()` and cache the state it returns.
+
+        On failure the instance is left uncached, so the next read goes upstream.
+        """
+        self._write_epoch += 1
+        self._states.pop(instance_id)
+        try:
+            state = await write()
+        finally:
+            self._write_epoch += 1
+        self.writes += 1
+        if state:
+            self._states.set(instance_id, state, self.ttl)
+        return state
+
+    def invalidate(self, instance_id: str) -> None:
+        """Drop the cached state of `instance_id`."""
+        self._write_epoch += 1
+        self._states.pop(instance_id)
+
+    def snapshot(self) -> Dict:
+        """Return the cache counters as a json dictionary."""
+        result = self._states.snapshot()
+        result['writes'] = self.writes
+        return result
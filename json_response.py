@@ -0,0 +1,18 @@
+# coding: utf-8
+
+"""
+FastAPI response class serializing with the json backend selected in `common`.
+"""
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from common import json_dumps_bytes
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by `common.json_dumps_bytes` (orjson when installed)."""
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps_bytes(content)
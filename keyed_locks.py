@@ -0,0 +1,104 @@
+# coding: utf-8
+
+"""
+Keyed asyncio locks.
+
+`KeyedLockRegistry` hands out one `asyncio.Lock` per key so that operations on the
+same key (e.g. a service `instance_id`) run one at a time, in arrival order, while
+different keys proceed in parallel. Idle keys are evicted in LRU order once the
+registry grows past `max_keys`.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict
+
+DEFAULT_MAX_KEYS = 10000
+
+
+class _KeyedLock:
+    """A lock and the number of tasks holding or waiting for it."""
+
+    __slots__ = ('lock', 'users')
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class KeyedLockRegistry:
+    """Registry of per-key asyncio locks, bounded with LRU eviction of idle keys."""
+
+    def __init__(self, *, max_keys: int = DEFAULT_MAX_KEYS) -> None:
+        """
+        Initialize a KeyedLockRegistry.
+
+        :param int max_keys: Number of keys kept before idle keys are evicted.
+               Keys that are held or awaited are never evicted.
+        """
+        self.max_keys = max_keys
+        self._locks: 'OrderedDict[str, _KeyedLock]' = OrderedDict()
+        self.acquisitions = 0
+        self.contended = 0
+        self.evictions = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        """Hold the lock for `key` for the duration of the `async with` block."""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = _KeyedLock()
+            self._locks[key] = entry
+        else:
+            self._locks.move_to_end(key)
+        entry.users += 1
+
+        if entry.lock.locked():
+            self.contended += 1
+        start = time.monotonic()
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            entry.users -= 1
+            self._evict()
+            raise
+        waited = time.monotonic() - start
+        self.acquisitions += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+        try:
+            yield
+        finally:
+            entry.lock.release()
+            entry.users -= 1
+            self._evict()
+
+    def _evict(self) -> None:
+        if len(self._locks) <= self.max_keys:
+            return
+        for key in list(self._locks):
+            if len(self._locks) <= self.max_keys:
+                break
+            if self._locks[key].users == 0:
+                del self._locks[key]
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def snapshot(self) -> Dict:
+        """Return the registry counters as a json dictionary."""
+        return {
+            'keys': len(self._locks),
+            'max_keys': self.max_keys,
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'evictions': self.evictions,
+            'wait_time_total': self.wait_time_total,
+            'wait_time_max': self.wait_time_max,
+        }
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+"""
+Cache of `last_operation` results, aware of terminal states.
+
+`in progress` results are kept for a short TTL so aggressive polling is absorbed
+without hiding progress for long. `succeeded` / `failed` results for a given
+`operation` identifier are final and are kept until the next mutating call
+(provision, update, deprovision) on the instance invalidates them. Results polled
+without an `operation` identifier cannot be told apart from a later operation
+started through another worker, so they are only kept for the short TTL.
+"""
+
+from typing import Dict, Optional, Set
+
+from ttl_cache import DEFAULT_MAX_ENTRIES, TTLCache
+
+DEFAULT_IN_PROGRESS_TTL = 2.0
+TERMINAL_STATES = frozenset(['succeeded', 'failed'])
+
+
+class LastOperationCache:
+    """Cache of `last_operation` results keyed by instance_id + operation."""
+
+    def __init__(
+        self, *, in_progress_ttl: float = DEFAULT_IN_PROGRESS_TTL, max_entries: int = DEFAULT_MAX_ENTRIES
+    ) -> None:
+        """
+        Initialize a LastOperationCache.
+
+        :param float in_progress_ttl: Seconds an `in progress` result is served
+               from the cache.
+        :param int max_entries: Number of results kept before LRU eviction.
+        """
+        self.in_progress_ttl = in_progress_ttl
+        self._results = TTLCache(max_entries=max_entries, on_evict=self._forget)
+        self._operations: Dict[str, Set[Optional[str]]] = {}
+        self.invalidations = 0
+
+    def get(self, instance_id: str, operation: Optional[str] = None) -> Optional[Dict]:
+        """Return the cached result for `instance_id` + `operation`, or `None`."""
+        return self._results.get((instance_id, operation))
+
+    def store(self, instance_id: str, operation: Optional[str], result: Dict) -> None:
+        """Cache `result`, for good if it is terminal and tied to an operation identifier."""
+        state = (result or {}).get('state')
+        ttl = None if state in TERMINAL_STATES and operation is not None else self.in_progress_ttl
+        self._results.set((instance_id, operation), result, ttl)
+        self._operations.setdefault(instance_id, set()).add(operation)
+
+    def invalidate(self, instance_id: str) -> None:
+        """Drop every cached result of `instance_id`; call on each mutating operation."""
+        for operation in self._operations.pop(instance_id, ()):
+            self._results.pop((instance_id, operation))
+        self.invalidations += 1
+
+    def _forget(self, key: tuple) -> None:
+        instance_id, operation = key
+        operations = self._operations.get(instance_id)
+        if operations is not None:
+            operations.discard(operation)
+            if not operations:
+                del self._operations[instance_id]
+
+    def snapshot(self) -> Dict:
+        """Return the cache counters as a json dictionary."""
+        result = self._results.snapshot()
+        result['invalidations'] = self.invalidations
+        return result
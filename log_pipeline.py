@@ -0,0 +1,409 @@
+# coding: utf-8
+
+"""
+Non-blocking logging pipeline.
+
+The request path only appends the `LogRecord` to a bounded queue
+(`OverloadQueueHandler`); message formatting (`%`-style arguments are merged only
+there), JSON encoding and file writes happen on the background thread of a
+`logging.handlers.QueueListener`. When the queue fills up, records below WARNING
+are sampled (one in `overload_sample` kept) and, once it is full, dropped, so a
+burst of logs never blocks the event loop. `GzipRotatingFileHandler` compresses
+rotated files on a separate thread, so rotation does not stall the writer either.
+
+`RouteSampler` cuts the volume of the chatty routes (health checks, last_operation
+polls) before the records reach the queue: each request of a route is sampled at
+the route's rate, and records under the route's level are held back. Held-back
+records are written anyway when the request turns out to have failed or been slow,
+so errors and slow requests are always logged in full. The rates and levels can be
+changed at runtime through a JSON file every worker re-reads when it changes.
+"""
+
+import contextvars
+import datetime
+import gzip
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional
+
+from common import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_HIGH_WATERMARK = 0.8
+DEFAULT_OVERLOAD_SAMPLE = 10
+DEFAULT_SLOW_REQUEST = 2.0
+DEFAULT_MAX_HELD = 100
+DEFAULT_RELOAD_INTERVAL = 5.0
+
+# Extra fields the BrokerAPI log calls pass (`extra={...}`)
+CONTEXT_FIELDS = ('method', 'endpoint', 'status_code')
+
+TEXT_FORMAT = (
+    '%(asctime)s - %(levelname)s - %(message)s '
+    '[method=%(method)s, endpoint=%(endpoint)s, status_code=%(status_code)s]'
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(
+                timespec='milliseconds'
+            ),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json_dumps(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """The historical BrokerAPI line format, tolerant of records without the context fields."""
+
+    def __init__(self) -> None:
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, None)
+        return super().format(record)
+
+
+class OverloadQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: it samples, then drops, records under overload."""
+
+    def __init__(
+        self,
+        log_queue: queue.Queue,
+        *,
+        high_watermark: float = DEFAULT_HIGH_WATERMARK,
+        overload_sample: int = DEFAULT_OVERLOAD_SAMPLE,
+    ) -> None:
+        """
+        Initialize an OverloadQueueHandler.
+
+        :param queue.Queue log_queue: Bounded queue read by the listener thread.
+        :param float high_watermark: Queue fill ratio above which records below
+               WARNING are sampled.
+        :param int overload_sample: Keep one in `overload_sample` records below
+               WARNING while over the high watermark.
+        """
+        super().__init__(log_queue)
+        self.high_mark = max(int(log_queue.maxsize * high_watermark), 1) if log_queue.maxsize > 0 else 0
+        self.overload_sample = max(overload_sample, 1)
+        self._sample_counter = 0
+        self.enqueued = 0
+        self.sampled_out = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare, leave msg / args unmerged: the listener thread formats them
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.high_mark and record.levelno < logging.WARNING and self.queue.qsize() >= self.high_mark:
+            self._sample_counter += 1
+            if self._sample_counter % self.overload_sample:
+                self.sampled_out += 1
+                return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.enqueued += 1
+
+
+class GzipRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler whose backups are gzip-compressed by a background thread."""
+
+    def __init__(self, filename: str, **kwargs) -> None:
+        super().__init__(filename, **kwargs)
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._rotate
+        self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log-compress')
+        self._pending: Optional[Future] = None
+
+    def doRollover(self) -> None:
+        # The backups are renamed one slot up: the previous compression must have landed first
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+        super().doRollover()
+
+    def _rotate(self, source: str, dest: str) -> None:
+        # Only a rename on the writer thread; compression runs on the compressor thread
+        pending = '{0}.{1}.tmp'.format(dest, threading.get_ident())
+        os.rename(source, pending)
+        try:
+            self._pending = self._compressor.submit(_compress, pending, dest)
+        except RuntimeError:
+            # Executor already shut down (interpreter exit): compress in place
+            _compress(pending, dest)
+
+    def close(self) -> None:
+        super().close()
+        self._compressor.shutdown(wait=True)
+
+
+def _compress(source: str, dest: str) -> None:
+    with open(source, 'rb') as raw, gzip.open(dest, 'wb') as compressed:
+        shutil.copyfileobj(raw, compressed)
+    os.remove(source)
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room rather than fail when stopping with a full queue
+        self.queue.put(self._sentinel)
+
+
+class _RequestLog:
+    """Sampling decision and held-back records of the request being handled."""
+
+    __slots__ = ('sampled', 'level', 'keep', 'closed', 'held', 'overflow')
+
+    def __init__(self, sampled: bool, level: int) -> None:
+        self.sampled = sampled
+        self.level = level
+        self.keep = False
+        self.closed = False
+        self.held: List[logging.LogRecord] = []
+        self.overflow = 0
+
+
+_request_log: contextvars.ContextVar = contextvars.ContextVar('request_log', default=None)
+
+
+def _level(value) -> int:
+    level = value if isinstance(value, int) else logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError('Unknown log level: {0}'.format(value))
+    return level
+
+
+class RouteSampler(logging.Filter):
+    """Per-route sampling and levels of the records logged while handling a request."""
+
+    def __init__(
+        self,
+        *,
+        rates: Dict[str, float] = None,
+        levels: Dict[str, str] = None,
+        default_rate: float = 1.0,
+        default_level: str = 'INFO',
+        slow_request: float = DEFAULT_SLOW_REQUEST,
+        max_held: int = DEFAULT_MAX_HELD,
+        config_path: Optional[str] = None,
+        reload_interval: float = DEFAULT_RELOAD_INTERVAL,
+    ) -> None:
+        """
+        Initialize a RouteSampler.
+
+        :param dict rates: (optional) Share of the requests logged, keyed by route name.
+        :param dict levels: (optional) Minimum level logged, keyed by route name.
+        :param float default_rate: Share of the requests logged for routes not in `rates`.
+        :param str default_level: Minimum level for routes not in `levels`.
+        :param float slow_request: Seconds after which a request is logged in full.
+        :param int max_held: Records held back per request; more are discarded.
+        :param str config_path: (optional) JSON file overriding the settings above
+               (`rates`, `levels`, `default_rate`, `default_level`, `slow_request`),
+               re-read when it changes.
+        :param float reload_interval: Seconds between checks of `config_path`.
+        """
+        super().__init__()
+        self._defaults = {
+            'rates': dict(rates or {}),
+            'levels': dict(levels or {}),
+            'default_rate': default_rate,
+            'default_level': default_level,
+            'slow_request': slow_request,
+        }
+        self.max_held = max_held
+        self.config_path = config_path
+        self.reload_interval = reload_interval
+        self._config_mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._target: Optional[logging.Handler] = None
+        self.requests = 0
+        self.sampled_out = 0
+        self.suppressed = 0
+        self.rescued = 0
+        self._apply(self._defaults)
+
+    def _apply(self, settings: Dict) -> None:
+        rates = {route: float(rate) for route, rate in settings['rates'].items()}
+        levels = {route: _level(level) for route, level in settings['levels'].items()}
+        default_rate = float(settings['default_rate'])
+        default_level = _level(settings['default_level'])
+        # Swapped in one assignment each, so a request never sees half a configuration
+        self.rates, self.levels = rates, levels
+        self.default_rate, self.default_level = default_rate, default_level
+        self.slow_request = float(settings['slow_request'])
+
+    def install(self, handler: logging.Handler) -> None:
+        """Filter the records of `handler`, which also receives the rescued ones."""
+        self._target = handler
+        handler.addFilter(self)
+
+    def reload(self) -> None:
+        """Re-read `config_path` if it changed; without the file, go back to the defaults."""
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._config_mtime:
+            return
+        settings = dict(self._defaults)
+        try:
+            if mtime is not None:
+                with open(self.config_path, 'rb') as config:
+                    settings.update(json_loads(config.read()))
+            self._apply(settings)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning('Ignoring invalid log sampling config %s: %s', self.config_path, e)
+        else:
+            logger.warning('Log sampling config %s', 'reloaded' if mtime is not None else 'reset to defaults')
+        self._config_mtime = mtime
+
+    def begin(self, route: Optional[str]) -> contextvars.Token:
+        """Start the log of a request to `route`; pass the returned token to `end`."""
+        if self.config_path:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + self.reload_interval
+                self.reload()
+        self.requests += 1
+        rate = self.rates.get(route, self.default_rate)
+        sampled = rate >= 1.0 or random.random() < rate
+        if not sampled:
+            self.sampled_out += 1
+        return _request_log.set(_RequestLog(sampled, self.levels.get(route, self.default_level)))
+
+    def end(self, token: contextvars.Token, status_code: int, duration: float) -> None:
+        """Finish the log of a request: write its held-back records if it failed or was slow."""
+        state = _request_log.get()
+        _request_log.reset(token)
+        state.closed = True
+        held, state.held = state.held, []
+        if state.keep or status_code >= 500 or duration >= self.slow_request:
+            self.rescued += len(held)
+            for record in held:
+                self._target.handle(record)
+        else:
+            self.suppressed += len(held)
+        self.suppressed += state.overflow
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        state = _request_log.get()
+        if state is None or state.closed or state.keep:
+            return True
+        if record.levelno >= logging.ERROR:
+            # The request failed: write what it held back first, then everything it logs
+            state.keep = True
+            held, state.held = state.held, []
+            self.rescued += len(held)
+            for earlier in held:
+                self._target.handle(earlier)
+            return True
+        if state.sampled and record.levelno >= state.level:
+            return True
+        if len(state.held) < self.max_held:
+            state.held.append(record)
+        else:
+            state.overflow += 1
+        return False
+
+    def snapshot(self) -> Dict:
+        """Return the sampling settings and counters as a json dictionary."""
+        return {
+            'rates': self.rates,
+            'levels': {route: logging.getLevelName(level) for route, level in self.levels.items()},
+            'default_rate': self.default_rate,
+            'default_level': logging.getLevelName(self.default_level),
+            'slow_request': self.slow_request,
+            'config_path': self.config_path,
+            'requests': self.requests,
+            'sampled_out': self.sampled_out,
+            'suppressed': self.suppressed,
+            'rescued': self.rescued,
+        }
+
+
+def parse_route_settings(value: str) -> Dict[str, str]:
+    """Parse `route=value` pairs separated by commas, e.g. `status=WARNING,last_operation=INFO`."""
+    settings = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        name, _, setting = item.partition('=')
+        settings[name.strip()] = setting.strip()
+    return settings
+
+
+class LogPipeline:
+    """A bounded queue, the handler feeding it and the listener thread draining it."""
+
+    def __init__(
+        self,
+        handlers: List[logging.Handler],
+        *,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        high_watermark: float = DEFAULT_HIGH_WATERMARK,
+        overload_sample: int = DEFAULT_OVERLOAD_SAMPLE,
+    ) -> None:
+        """
+        Initialize a LogPipeline.
+
+        :param list handlers: Handlers run by the listener thread (console, file).
+        :param int max_queue: Records waiting to be written; more are dropped.
+        :param float high_watermark: See `OverloadQueueHandler`.
+        :param int overload_sample: See `OverloadQueueHandler`.
+        """
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.handler = OverloadQueueHandler(self.queue, high_watermark=high_watermark, overload_sample=overload_sample)
+        self.handlers = handlers
+        self.listener = _Listener(self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    def start(self) -> None:
+        """Start the listener thread."""
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def stop(self) -> None:
+        """Write the queued records, stop the listener thread and close the handlers."""
+        if self._started:
+            self.listener.stop()
+            self._started = False
+        for handler in self.handlers:
+            handler.close()
+
+    def snapshot(self) -> Dict:
+        """Return the queue depth and the record counters as a json dictionary."""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'max_queue': self.queue.maxsize,
+            'enqueued': self.handler.enqueued,
+            'sampled_out': self.handler.sampled_out,
+            'dropped': self.handler.dropped,
+        }
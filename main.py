@@ -1,49 +1,208 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi import Request
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from ibm_cloud_sdk_core import ApiException
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-from typing import Dict, Optional
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+from async_broker_sdk import AsyncOpenServiceBrokerV1
 from broker_sdk import OpenServiceBrokerV1
+from catalog_cache import CatalogCache
+from catalog_snapshot import SharedCatalogSnapshot
+from iam_token_cache import SharedIAMTokenManager
+from idempotency import IdempotencyConflict, IdempotencyStore, body_fingerprint
+from instance_state_cache import InstanceStateCache
+from keyed_locks import KeyedLockRegistry
+from last_operation_cache import LastOperationCache
+from negative_cache import GoneInstanceCache
+from single_flight import SingleFlight
+from transport import PooledTransport, mount_pooled_adapter
+from retry import IDEMPOTENCY_KEY_HEADER, RetryBudget, RetryPolicy, install_sync_retry
+from passthrough import passthrough_response
+from json_response import FastJSONResponse
+from common import json_loads, set_json_backend
+from bulk import NDJSON_MEDIA_TYPE, fan_out, iter_items, iter_list, ndjson_lines
+from offload import OffloadDispatcher, OffloadedOpenServiceBrokerV1, OffloadQueueFull, parse_limits
+from circuit_breaker import CircuitBreakerRegistry, CircuitBreakingBroker, CircuitOpen
+from upstream_pool import UpstreamPool, install_sync_pool, parse_urls
+from log_pipeline import GzipRotatingFileHandler, JsonFormatter, LogPipeline, RouteSampler, TextFormatter, parse_route_settings
+from deadline import DeadlinePolicy, is_timeout, parse_route_timeouts, reset_deadline, set_deadline
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import asyncio
 import os
+import time
+import atexit
 import logging
 from logging.handlers import RotatingFileHandler
  
-# Configuração do logger
+# Configuração do logger (handlers configurados após a leitura das variáveis de ambiente)
 logger = logging.getLogger("BrokerAPI")
 logger.setLevel(logging.INFO)
  
-# Formato do log
-log_format = logging.Formatter(
-    '%(asctime)s - %(levelname)s - %(message)s [method=%(method)s, endpoint=%(endpoint)s, status_code=%(status_code)s]'
-)
+# Carregar variáveis de ambiente
+load_dotenv()
+API_KEY = os.getenv("IAM_APIKEY")
+ENVIRONMENT = os.getenv("ENVIRONMENT")
+BROKER_SERVICE_URL = os.getenv("BROKER_SERVICE_URL")
+BROKER_SERVICE_URLS = parse_urls(BROKER_SERVICE_URL)
+BROKER_LB_POLICY = os.getenv("BROKER_LB_POLICY", "peak_ewma")
+BROKER_LB_DECAY_SECONDS = float(os.getenv("BROKER_LB_DECAY_SECONDS", "10"))
+BROKER_OUTLIER_CONSECUTIVE_FAILURES = int(os.getenv("BROKER_OUTLIER_CONSECUTIVE_FAILURES", "5"))
+BROKER_OUTLIER_EJECTION_SECONDS = float(os.getenv("BROKER_OUTLIER_EJECTION_SECONDS", "30"))
+BROKER_OUTLIER_MAX_EJECTION_PERCENT = float(os.getenv("BROKER_OUTLIER_MAX_EJECTION_PERCENT", "50"))
+BROKER_HEALTH_CHECK_INTERVAL = float(os.getenv("BROKER_HEALTH_CHECK_INTERVAL", "10"))
+BROKER_HEALTH_CHECK_PATH = os.getenv("BROKER_HEALTH_CHECK_PATH", "/v2/catalog")
+BROKER_HEALTH_CHECK_TIMEOUT = float(os.getenv("BROKER_HEALTH_CHECK_TIMEOUT", "2"))
+BROKER_MAX_CONNECTIONS = int(os.getenv("BROKER_MAX_CONNECTIONS", "200"))
+BROKER_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("BROKER_MAX_KEEPALIVE_CONNECTIONS", "50"))
+BROKER_KEEPALIVE_EXPIRY = float(os.getenv("BROKER_KEEPALIVE_EXPIRY", "5"))
+BROKER_HTTP2 = os.getenv("BROKER_HTTP2", "false").lower() == "true"
+BROKER_PASSTHROUGH = os.getenv("BROKER_PASSTHROUGH", "false").lower() == "true"
+BROKER_STREAM_THRESHOLD = int(os.getenv("BROKER_STREAM_THRESHOLD", "65536"))
+JSON_BACKEND = os.getenv("JSON_BACKEND", "")
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+RETRY_MAX_RETRY_AFTER = float(os.getenv("RETRY_MAX_RETRY_AFTER", "10"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "5"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "3"))
+DEADLINE_HEADER = os.getenv("DEADLINE_HEADER", "X-Request-Timeout-Ms")
+DEADLINE_DEFAULT_SECONDS = float(os.getenv("DEADLINE_DEFAULT_SECONDS", "55"))
+DEADLINE_ROUTE_SECONDS = parse_route_timeouts(os.getenv("DEADLINE_ROUTE_SECONDS", "catalog=10,last_operation=10,instance_state=10"))
+DEADLINE_MIN_BUDGET_SECONDS = float(os.getenv("DEADLINE_MIN_BUDGET_SECONDS", "0.5"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "16"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+LAST_OPERATION_BATCH_CONCURRENCY = int(os.getenv("LAST_OPERATION_BATCH_CONCURRENCY", "32"))
+LAST_OPERATION_BATCH_ITEM_TIMEOUT = float(os.getenv("LAST_OPERATION_BATCH_ITEM_TIMEOUT", "5"))
+LAST_OPERATION_BATCH_MAX_ITEMS = int(os.getenv("LAST_OPERATION_BATCH_MAX_ITEMS", "1000"))
+BROKER_CLIENT_MODE = os.getenv("BROKER_CLIENT_MODE", "async")
+BROKER_OFFLOAD_WORKERS = int(os.getenv("BROKER_OFFLOAD_WORKERS", "32"))
+BROKER_OFFLOAD_LIMITS = parse_limits(os.getenv("BROKER_OFFLOAD_LIMITS", ""))
+BROKER_OFFLOAD_DEFAULT_LIMIT = int(os.getenv("BROKER_OFFLOAD_DEFAULT_LIMIT", "8"))
+BROKER_OFFLOAD_QUEUE = int(os.getenv("BROKER_OFFLOAD_QUEUE", "128"))
+INSTANCE_LOCKS_MAX_KEYS = int(os.getenv("INSTANCE_LOCKS_MAX_KEYS", "10000"))
+SINGLE_FLIGHT_FOLLOWER_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_FOLLOWER_TIMEOUT", "30"))
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "300"))
+CATALOG_REFRESH_AHEAD = float(os.getenv("CATALOG_REFRESH_AHEAD", "0.8"))
+CATALOG_STALE_WHILE_REVALIDATE_SECONDS = float(os.getenv("CATALOG_STALE_WHILE_REVALIDATE_SECONDS", "60"))
+CATALOG_STALE_IF_ERROR_SECONDS = float(os.getenv("CATALOG_STALE_IF_ERROR_SECONDS", "3600"))
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "catalog.snapshot")
+LAST_OPERATION_IN_PROGRESS_TTL = float(os.getenv("LAST_OPERATION_IN_PROGRESS_TTL", "2"))
+LAST_OPERATION_CACHE_MAX_ENTRIES = int(os.getenv("LAST_OPERATION_CACHE_MAX_ENTRIES", "10000"))
+INSTANCE_STATE_TTL = float(os.getenv("INSTANCE_STATE_TTL", "30"))
+INSTANCE_STATE_CACHE_MAX_ENTRIES = int(os.getenv("INSTANCE_STATE_CACHE_MAX_ENTRIES", "10000"))
+GONE_INSTANCES_TTL = float(os.getenv("GONE_INSTANCES_TTL", "300"))
+GONE_INSTANCES_MAX_ENTRIES = int(os.getenv("GONE_INSTANCES_MAX_ENTRIES", "10000"))
+GONE_INSTANCES_BLOOM_CAPACITY = int(os.getenv("GONE_INSTANCES_BLOOM_CAPACITY", "0"))
+GONE_INSTANCES_BLOOM_ERROR_RATE = float(os.getenv("GONE_INSTANCES_BLOOM_ERROR_RATE", "0.001"))
+GONE_INSTANCES_DB_PATH = os.getenv("GONE_INSTANCES_DB_PATH", "")
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", "idempotency.sqlite3")
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IAM_TOKEN_CACHE_PATH = os.getenv("IAM_TOKEN_CACHE_PATH", "iam_token.cache")
+IAM_TOKEN_REFRESH_LEAD_SECONDS = float(os.getenv("IAM_TOKEN_REFRESH_LEAD_SECONDS", "120"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_FILE = os.getenv("LOG_FILE", "broker_api.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+LOG_COMPRESS_ROTATED = os.getenv("LOG_COMPRESS_ROTATED", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_HIGH_WATERMARK = float(os.getenv("LOG_QUEUE_HIGH_WATERMARK", "0.8"))
+LOG_OVERLOAD_SAMPLE = int(os.getenv("LOG_OVERLOAD_SAMPLE", "10"))
+LOG_ROUTE_SAMPLE_RATES = parse_route_settings(os.getenv("LOG_ROUTE_SAMPLE_RATES", "last_operation=0.1"))
+LOG_ROUTE_LEVELS = parse_route_settings(os.getenv("LOG_ROUTE_LEVELS", "status=WARNING,metrics=WARNING"))
+LOG_SLOW_REQUEST_SECONDS = float(os.getenv("LOG_SLOW_REQUEST_SECONDS", "2"))
+LOG_SAMPLING_CONFIG_PATH = os.getenv("LOG_SAMPLING_CONFIG_PATH", "log_sampling.json")
+LOG_SAMPLING_RELOAD_SECONDS = float(os.getenv("LOG_SAMPLING_RELOAD_SECONDS", "5"))
+ 
+# Formato do log: uma linha JSON por registro (LOG_FORMAT=json) ou o formato texto anterior (LOG_FORMAT=text)
+log_format = JsonFormatter() if LOG_FORMAT == "json" else TextFormatter()
  
 # Handler para console
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(log_format)
-logger.addHandler(console_handler)
  
-# Handler para arquivo com rotação (máx. 5MB, até 10 arquivos de backup)
-file_handler = RotatingFileHandler(
-    filename="broker_api.log",
-    maxBytes=5 * 1024 * 1024,  # 5MB
-    backupCount=10
+# Handler para arquivo com rotação (máx. LOG_MAX_BYTES, até LOG_BACKUP_COUNT arquivos de backup,
+# comprimidos com gzip em segundo plano quando LOG_COMPRESS_ROTATED=true)
+file_handler_class = GzipRotatingFileHandler if LOG_COMPRESS_ROTATED else RotatingFileHandler
+file_handler = file_handler_class(
+    filename=LOG_FILE,
+    maxBytes=LOG_MAX_BYTES,
+    backupCount=LOG_BACKUP_COUNT
 )
 file_handler.setFormatter(log_format)
-logger.addHandler(file_handler)
  
-# Carregar variáveis de ambiente
-load_dotenv()
-API_KEY = os.getenv("IAM_APIKEY")
-ENVIRONMENT = os.getenv("ENVIRONMENT")
+# As rotas apenas enfileiram os registros: formatação, escrita e rotação acontecem em uma thread
+# de fundo. Com a fila acima de LOG_QUEUE_HIGH_WATERMARK, só 1 em LOG_OVERLOAD_SAMPLE registros
+# abaixo de WARNING é mantido, e com a fila cheia os registros são descartados (sem bloquear)
+log_pipeline = LogPipeline(
+    [console_handler, file_handler],
+    max_queue=LOG_QUEUE_SIZE,
+    high_watermark=LOG_QUEUE_HIGH_WATERMARK,
+    overload_sample=LOG_OVERLOAD_SAMPLE
+)
+# O logger das rotas e os loggers dos módulos do broker passam todos pela mesma fila (sem handler, os
+# registros dos módulos iriam em texto puro e síncronos para o stderr, fora do broker_api.log)
+for logger_name in ("BrokerAPI", "catalog_cache", "iam_token_cache", "log_pipeline", "retry", "transport", "upstream_pool"):
+    module_logger = logging.getLogger(logger_name)
+    module_logger.setLevel(logging.INFO)
+    module_logger.addHandler(log_pipeline.handler)
+log_pipeline.start()
+atexit.register(log_pipeline.stop)
+ 
+# Amostragem por rota: só uma fração LOG_ROUTE_SAMPLE_RATES das requisições de cada rota é registrada,
+# e registros abaixo do nível LOG_ROUTE_LEVELS da rota são retidos. Requisições com erro ou mais lentas
+# que LOG_SLOW_REQUEST_SECONDS têm todos os seus registros gravados. Os valores podem ser alterados sem
+# reiniciar editando o arquivo JSON LOG_SAMPLING_CONFIG_PATH (relido por todos os workers), por exemplo:
+# {"rates": {"last_operation": 0.05}, "levels": {"status": "ERROR"}, "slow_request": 1.5}
+route_sampler = RouteSampler(
+    rates=LOG_ROUTE_SAMPLE_RATES,
+    levels=LOG_ROUTE_LEVELS,
+    slow_request=LOG_SLOW_REQUEST_SECONDS,
+    config_path=LOG_SAMPLING_CONFIG_PATH or None,
+    reload_interval=LOG_SAMPLING_RELOAD_SECONDS
+)
+route_sampler.install(log_pipeline.handler)
  
 if not API_KEY:
     logger.error("API_KEY not found in environment variables")
     raise ValueError("IAM_APIKEY environment variable is required")
  
+# Serializador JSON usado pelo SDK e pelas respostas da API (orjson quando instalado, ou stdlib)
+if JSON_BACKEND:
+    set_json_backend(JSON_BACKEND)
+ 
+# Ciclo de vida da aplicação: renova o token IAM e atualiza o catálogo em segundo
+# plano e libera as conexões com o broker ao encerrar o worker
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await iam_token_manager.start()
+    if upstream_pool is not None:
+        upstream_pool.start()
+    catalog_cache.start()
+    yield
+    await catalog_cache.stop()
+    if upstream_pool is not None:
+        await upstream_pool.stop()
+    await iam_token_manager.stop()
+    await broker_service.close()
+ 
 # Configuração do FastAPI
-app = FastAPI(title="Open Service Broker API",debug=ENVIRONMENT == 'development')
+app = FastAPI(
+    title="Open Service Broker API",
+    debug=ENVIRONMENT == 'development',
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
+)
  
 # Middleware para validar o header X-Broker-Api-Version
 @app.middleware("http")
@@ -55,16 +214,240 @@ async def validar_header_x_broker_api_version(request: Request, call_next):
             "Header X-Broker-Api-Version ausente ou inválido",
             extra={"method": request.method, "endpoint": request.url.path, "status_code": 412}
         )
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=412,
             content={"detail": "Cabeçalho 'X-Broker-Api-Version' ausente ou inválido. A versão obrigatória é 2.12."}
         )
  
     return await call_next(request)
  
+# Prazo de cada requisição: o orçamento enviado pela plataforma no header DEADLINE_HEADER (ms),
+# limitado pelo padrão da rota (DEADLINE_ROUTE_SECONDS / DEADLINE_DEFAULT_SECONDS, abaixo do
+# timeout de 60s do gunicorn). O tempo restante vira o timeout de conexão/leitura das chamadas ao
+# broker, e a requisição é abandonada com 504 quando sobra menos que DEADLINE_MIN_BUDGET_SECONDS
+deadline_policy = DeadlinePolicy(
+    default=DEADLINE_DEFAULT_SECONDS,
+    routes=DEADLINE_ROUTE_SECONDS,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    min_budget=DEADLINE_MIN_BUDGET_SECONDS,
+    header=DEADLINE_HEADER
+)
+ 
+def route_name(method: str, path: str) -> Optional[str]:
+    parts = path.strip("/").split("/")
+    if parts == ["status"]:
+        return "status"
+    if parts == ["metrics"]:
+        return "metrics"
+    if parts == ["v2", "catalog"]:
+        return "catalog"
+    if parts[:2] == ["v2", "bulk"]:
+        return "bulk"
+    if parts[:1] == ["bluemix_v1"]:
+        return "instance_state"
+    if parts[:2] == ["v2", "service_instances"]:
+        if len(parts) == 4 and parts[3] == "last_operation":
+            return "last_operation"
+        if len(parts) > 3:
+            return "bindings"
+        return {"PUT": "provision", "PATCH": "update", "DELETE": "delete"}.get(method)
+    return None
+ 
+@app.middleware("http")
+async def aplicar_prazo_da_requisicao(request: Request, call_next):
+    deadline = deadline_policy.deadline_for(
+        route_name(request.method, request.url.path),
+        request.headers.get(deadline_policy.header)
+    )
+    if deadline.remaining() < deadline_policy.min_budget:
+        deadline_policy.rejected += 1
+        logger.warning(
+            "Request deadline too short, rejected before processing",
+            extra={"method": request.method, "endpoint": request.url.path, "status_code": 504}
+        )
+        return FastJSONResponse(status_code=504, content={"detail": "Prazo da requisição insuficiente para consultar o broker"})
+    token = set_deadline(deadline)
+    try:
+        return await call_next(request)
+    finally:
+        reset_deadline(token)
+ 
+# Decide, no início de cada requisição, se os seus logs são gravados (ver route_sampler)
+@app.middleware("http")
+async def amostrar_logs_da_requisicao(request: Request, call_next):
+    started = time.monotonic()
+    token = route_sampler.begin(route_name(request.method, request.url.path))
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route_sampler.end(token, status_code, time.monotonic() - started)
+ 
 # Configuração do Open Service Broker
+# - "async" (padrão): cliente assíncrono com pool de conexões
+# - "threadpool": SDK síncrono executado em um pool de threads dedicado e limitado
+# Com BROKER_PASSTHROUGH=true, as rotas de instância repassam status, cabeçalhos e corpo do broker
+# sem decodificar e recodificar o JSON (corpos maiores que BROKER_STREAM_THRESHOLD são transmitidos em streaming)
 authenticator = IAMAuthenticator(API_KEY)
-broker_service = OpenServiceBrokerV1(authenticator=authenticator)
+# O token IAM é renovado antes de expirar, fora do caminho das requisições, e
+# compartilhado entre os workers através de um arquivo (IAM_TOKEN_CACHE_PATH)
+iam_token_manager = SharedIAMTokenManager(
+    authenticator,
+    path=IAM_TOKEN_CACHE_PATH or None,
+    refresh_lead=IAM_TOKEN_REFRESH_LEAD_SECONDS
+)
+# Leituras idênticas em andamento (catálogo, last_operation) compartilham uma única chamada ao broker
+single_flight = SingleFlight(follower_timeout=SINGLE_FLIGHT_FOLLOWER_TIMEOUT)
+# Falhas transitórias (502/503/504, conexão) de requisições idempotentes são repetidas com backoff,
+# limitadas por um orçamento global de retentativas (RETRY_BUDGET_RATIO das requisições)
+retry_policy = RetryPolicy(
+    max_attempts=RETRY_MAX_ATTEMPTS,
+    base_delay=RETRY_BASE_DELAY,
+    max_delay=RETRY_MAX_DELAY,
+    max_retry_after=RETRY_MAX_RETRY_AFTER,
+    budget=RetryBudget(ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND)
+)
+# Com várias URLs em BROKER_SERVICE_URL (separadas por vírgula), cada chamada vai para a réplica
+# menos carregada (peak-EWMA ou menos requisições em andamento); réplicas com falhas seguidas são
+# ejetadas por um tempo e as que não respondem às sondas de saúde saem de rotação.
+# Com uma só URL o pool também é criado (sem sondas): a URL do SDK vem sempre da URL normalizada
+# do pool (primary_url), a mesma que o pool usa para redirecionar cada tentativa
+upstream_pool = UpstreamPool(
+    BROKER_SERVICE_URLS,
+    policy=BROKER_LB_POLICY,
+    decay=BROKER_LB_DECAY_SECONDS,
+    consecutive_failures=BROKER_OUTLIER_CONSECUTIVE_FAILURES,
+    ejection_time=BROKER_OUTLIER_EJECTION_SECONDS,
+    max_ejection_percent=BROKER_OUTLIER_MAX_EJECTION_PERCENT,
+    probe_interval=BROKER_HEALTH_CHECK_INTERVAL,
+    probe_path=BROKER_HEALTH_CHECK_PATH,
+    probe_timeout=BROKER_HEALTH_CHECK_TIMEOUT
+) if BROKER_SERVICE_URLS else None
+service_url = upstream_pool.primary_url if upstream_pool is not None else None
+offload_dispatcher = None
+transport = None
+if BROKER_CLIENT_MODE == "threadpool":
+    sync_broker_service = OpenServiceBrokerV1(authenticator=authenticator)
+    mount_pooled_adapter(sync_broker_service, max_connections=BROKER_MAX_CONNECTIONS)
+    if upstream_pool is not None:
+        install_sync_pool(sync_broker_service, upstream_pool)
+    install_sync_retry(sync_broker_service, retry_policy)
+    if service_url:
+        sync_broker_service.set_service_url(service_url)
+    offload_dispatcher = OffloadDispatcher(
+        max_workers=BROKER_OFFLOAD_WORKERS,
+        limits=BROKER_OFFLOAD_LIMITS,
+        default_limit=BROKER_OFFLOAD_DEFAULT_LIMIT,
+        max_queue=BROKER_OFFLOAD_QUEUE
+    )
+    broker_service = OffloadedOpenServiceBrokerV1(sync_broker_service, offload_dispatcher, single_flight=single_flight)
+else:
+    # Pool de conexões por host do broker (BROKER_MAX_CONNECTIONS), com HTTP/2 opcional (BROKER_HTTP2)
+    transport = PooledTransport(
+        max_connections=BROKER_MAX_CONNECTIONS,
+        max_keepalive_connections=BROKER_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=BROKER_KEEPALIVE_EXPIRY,
+        http2=BROKER_HTTP2
+    )
+    broker_service = AsyncOpenServiceBrokerV1(
+        authenticator=authenticator,
+        single_flight=single_flight,
+        transport=transport,
+        stream_threshold=BROKER_STREAM_THRESHOLD,
+        retry_policy=retry_policy,
+        upstream_pool=upstream_pool
+    )
+    if service_url:
+        broker_service.set_service_url(service_url)
+ 
+# Um circuit breaker por operação (catálogo, provision, update, delete, last_operation, bindings):
+# com muitas falhas ou respostas lentas do broker na janela recente, o circuito abre e as chamadas
+# daquela operação são recusadas na hora com 503 + Retry-After, até que chamadas de teste tenham sucesso
+circuit_breakers = CircuitBreakerRegistry(
+    window=BREAKER_WINDOW,
+    min_calls=BREAKER_MIN_CALLS,
+    failure_rate=BREAKER_FAILURE_RATE,
+    slow_call_duration=BREAKER_SLOW_CALL_SECONDS,
+    slow_call_rate=BREAKER_SLOW_CALL_RATE,
+    open_duration=BREAKER_OPEN_SECONDS,
+    half_open_calls=BREAKER_HALF_OPEN_CALLS
+)
+broker_service = CircuitBreakingBroker(broker_service, circuit_breakers)
+ 
+# Serializa operações concorrentes (PUT/PATCH/DELETE) sobre o mesmo instance_id
+instance_locks = KeyedLockRegistry(max_keys=INSTANCE_LOCKS_MAX_KEYS)
+ 
+# Cache de last_operation: "in progress" por poucos segundos, estados finais até a próxima alteração da instância
+last_operation_cache = LastOperationCache(
+    in_progress_ttl=LAST_OPERATION_IN_PROGRESS_TTL,
+    max_entries=LAST_OPERATION_CACHE_MAX_ENTRIES
+)
+ 
+# Instâncias que o broker já informou como removidas (404/410): DELETE e last_operation
+# repetidos pela plataforma são respondidos com 410 Gone sem chamar o broker.
+# Com GONE_INSTANCES_BLOOM_CAPACITY > 0, um filtro de Bloom mantém os ids após o TTL.
+# Com GONE_INSTANCES_DB_PATH (opcional, pode ser o mesmo arquivo do IDEMPOTENCY_DB_PATH), os ids
+# removidos são compartilhados entre os workers no SQLite, para que um reprovisionamento valha para
+# todos; custa uma leitura ou escrita no SQLite por PUT, DELETE e last_operation, e nesse caso a
+# tabela é a única memória e o filtro de Bloom não é usado
+gone_instances = GoneInstanceCache(
+    ttl=GONE_INSTANCES_TTL,
+    max_entries=GONE_INSTANCES_MAX_ENTRIES,
+    bloom_capacity=GONE_INSTANCES_BLOOM_CAPACITY,
+    bloom_error_rate=GONE_INSTANCES_BLOOM_ERROR_RATE,
+    path=GONE_INSTANCES_DB_PATH or None
+)
+ 
+# Respostas de provisionamento já concluídas, compartilhadas entre os workers (SQLite):
+# um PUT repetido com o mesmo corpo é respondido sem chamar o broker, e um corpo diferente recebe 409
+idempotency_store = IdempotencyStore(
+    IDEMPOTENCY_DB_PATH,
+    ttl=IDEMPOTENCY_TTL_SECONDS,
+    max_entries=IDEMPOTENCY_MAX_ENTRIES
+) if IDEMPOTENCY_DB_PATH else None
+ 
+# Cache do catálogo com atualização em segundo plano (stale-while-revalidate / stale-if-error).
+# Com CATALOG_SNAPSHOT_PATH, apenas um worker busca o catálogo no broker e o publica
+# em um arquivo mapeado em memória lido pelos demais workers.
+async def fetch_catalog() -> Dict:
+    response = await broker_service.list_catalog()
+    return response.get_result()
+ 
+catalog_cache = CatalogCache(
+    fetch_catalog,
+    ttl=CATALOG_TTL_SECONDS,
+    refresh_ahead=CATALOG_REFRESH_AHEAD,
+    stale_while_revalidate=CATALOG_STALE_WHILE_REVALIDATE_SECONDS,
+    stale_if_error=CATALOG_STALE_IF_ERROR_SECONDS,
+    shared_snapshot=SharedCatalogSnapshot(CATALOG_SNAPSHOT_PATH) if CATALOG_SNAPSHOT_PATH else None
+)
+ 
+# Cache do estado (habilitada/desabilitada) das instâncias, atualizado a cada alteração de estado
+async def fetch_instance_state(instance_id: str) -> Dict:
+    response = await broker_service.get_service_instance_state(instance_id=instance_id)
+    return response.get_result()
+ 
+instance_state_cache = InstanceStateCache(
+    fetch_instance_state,
+    ttl=INSTANCE_STATE_TTL,
+    max_entries=INSTANCE_STATE_CACHE_MAX_ENTRIES
+)
+ 
+# Converte falhas na chamada ao broker em respostas HTTP
+def http_exception_for(e: Exception, status_code: int, detail: Optional[str] = None) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, IdempotencyConflict):
+        return HTTPException(status_code=409, detail=str(e))
+    if isinstance(e, CircuitOpen):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(int(e.retry_after + 0.999), 1))})
+    if isinstance(e, OffloadQueueFull):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if isinstance(e, asyncio.TimeoutError) or is_timeout(e):
+        return HTTPException(status_code=504, detail="Tempo de espera pela resposta do broker esgotado")
+    return HTTPException(status_code=status_code, detail=detail or str(e))
  
 # Modelo para solicitações de provisionamento e atualização
 class ServiceRequest(BaseModel):
@@ -73,8 +456,57 @@ class ServiceRequest(BaseModel):
     organization_guid: str
     space_guid: str
     parameters: Optional[Dict] = None
+    previous_values: Optional[Dict] = None
     accepts_incomplete: Optional[bool] = None
  
+# Modelo do corpo de uma atualização (PATCH): a plataforma não envia organization_guid / space_guid
+class ServiceUpdateRequest(BaseModel):
+    service_id: str
+    plan_id: str
+    parameters: Optional[Dict] = None
+    previous_values: Optional[Dict] = None
+    accepts_incomplete: Optional[bool] = None
+ 
+# Modelo para alteração do estado (habilitar/desabilitar) de uma instância
+class InstanceStateRequest(BaseModel):
+    enabled: bool
+    initiator_id: Optional[str] = None
+    reason_code: Optional[str] = None
+ 
+# Modelo de um item das operações em lote (provision, update ou delete de uma instância)
+class BulkInstanceItem(BaseModel):
+    operation: Literal["provision", "update", "delete"]
+    instance_id: str
+    service_id: str
+    plan_id: str
+    organization_guid: Optional[str] = None
+    space_guid: Optional[str] = None
+    parameters: Optional[Dict] = None
+    previous_values: Optional[Dict] = None
+    accepts_incomplete: Optional[bool] = None
+ 
+# Modelo de um item da consulta de last_operation em lote
+class LastOperationQuery(BaseModel):
+    instance_id: str
+    operation: Optional[str] = None
+    service_id: Optional[str] = None
+    plan_id: Optional[str] = None
+ 
+# Valida service_id/plan_id localmente com o índice do catálogo em cache, antes de chamar o broker.
+# Sem catálogo carregado, a validação fica a cargo do broker.
+def validate_against_catalog(body: Union[ServiceRequest, ServiceUpdateRequest], check_plan_change: bool = False) -> None:
+    index = catalog_cache.index
+    if index is None:
+        return
+    error = index.validate_plan(body.service_id, body.plan_id)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    if check_plan_change:
+        previous_plan_id = (body.previous_values or {}).get("plan_id")
+        error = index.validate_plan_change(body.service_id, body.plan_id, previous_plan_id)
+        if error:
+            raise HTTPException(status_code=422, detail=error)
+ 
     # Teste da API``
 @app.get("/teste")
 async def teste (request: ServiceRequest):
@@ -90,31 +522,39 @@ async def status():
     """
     Verifica o status da API.
     """
-    logger.info("Received status check request", extra={"method": "GET", "endpoint": "/", "status_code": 200})
+    logger.info("Received status check request", extra={"method": "GET", "endpoint": "/status", "status_code": 200})
     response = {"status": "ok"}
-    logger.info("Status check successful", extra={"method": "GET", "endpoint": "/", "status_code": 200})
+    logger.info("Status check successful", extra={"method": "GET", "endpoint": "/status", "status_code": 200})
     return response
  
 # Listar catálogo de serviços
 @app.get("/v2/catalog")
-async def catalog():
+async def catalog(request: Request):
     """
     Retorna o catálogo de serviços disponíveis.
+    O corpo já vem serializado (e comprimido) do cache; a variante é escolhida pelo Accept-Encoding.
     """
     logger.info("Fetching service catalog", extra={"method": "GET", "endpoint": "/v2/catalog", "status_code": 0})
     try:
-        result = broker_service.list_catalog().get_result()
-        logger.info(
-            f"Catalog fetched successfully: {len(result.get('services', []))} services",
-            extra={"method": "GET", "endpoint": "/v2/catalog", "status_code": 200}
-        )
-        return result
+        encoded = await catalog_cache.get_encoded()
     except Exception as e:
+        error = http_exception_for(e, 500, detail=f"Erro ao buscar catálogo: {str(e)}")
         logger.error(
-            f"Failed to fetch catalog: {str(e)}",
-            extra={"method": "GET", "endpoint": "/v2/catalog", "status_code": 500}
+            "Failed to fetch catalog: %s", e,
+            extra={"method": "GET", "endpoint": "/v2/catalog", "status_code": error.status_code}
         )
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar catálogo: {str(e)}")
+        raise error
+    headers = {"ETag": encoded.etag, "Vary": "Accept-Encoding"}
+    if request.headers.get("If-None-Match") == encoded.etag:
+        return Response(status_code=304, headers=headers)
+    content, encoding = encoded.select(request.headers.get("Accept-Encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    logger.info(
+        "Catalog fetched successfully: %s services", encoded.service_count,
+        extra={"method": "GET", "endpoint": "/v2/catalog", "status_code": 200}
+    )
+    return Response(content=content, media_type="application/json", headers=headers)
  
 # Provisionar (criar ou substituir) uma instância de serviço
 @app.put("/v2/service_instances/{instance_id}")
@@ -123,60 +563,97 @@ async def provision_service_instance(instance_id: str, body: ServiceRequest):
     Cria ou substitui uma instância de serviço com base no instance_id.
     """
     logger.info(
-        f"Provisioning instance {instance_id} with service_id={body.service_id}, plan_id={body.plan_id}",
+        "Provisioning instance %s with service_id=%s, plan_id=%s", instance_id, body.service_id, body.plan_id,
         extra={"method": "PUT", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 0}
     )
     try:
-        result = broker_service.replace_service_instance(
-            instance_id=instance_id,
-            service_id=body.service_id,
-            plan_id=body.plan_id,
-            organization_guid=body.organization_guid,
-            space_guid=body.space_guid,
-            parameters=body.parameters,
-            accepts_incomplete=body.accepts_incomplete
-        ).get_result()
+        validate_against_catalog(body)
+        fingerprint = body_fingerprint(body.model_dump())
+        async with instance_locks.hold(instance_id):
+            # Repetição de um provisionamento já concluído: 201 vira 200 (instância já existe com os mesmos atributos)
+            replay = await idempotency_store.get(instance_id, fingerprint) if idempotency_store else None
+            if replay is not None:
+                status_code, result = replay
+                logger.info(
+                    "Instance %s provision replayed from idempotency store", instance_id,
+                    extra={"method": "PUT", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": status_code}
+                )
+                return FastJSONResponse(status_code=200 if status_code == 201 else status_code, content=result)
+            await gone_instances.discard(instance_id)
+            try:
+                response = await broker_service.replace_service_instance(
+                    instance_id=instance_id,
+                    service_id=body.service_id,
+                    plan_id=body.plan_id,
+                    organization_guid=body.organization_guid,
+                    space_guid=body.space_guid,
+                    parameters=body.parameters,
+                    accepts_incomplete=body.accepts_incomplete,
+                    # A chave de idempotência permite repetir o PUT em falhas transitórias
+                    headers={IDEMPOTENCY_KEY_HEADER: fingerprint}
+                )
+            finally:
+                last_operation_cache.invalidate(instance_id)
+            status_code = response.get_status_code()
+            # Um 202 (provisionamento assíncrono em andamento) não é gravado: a repetição consulta o broker
+            if idempotency_store:
+                await idempotency_store.put(instance_id, fingerprint, status_code, response.get_result())
         logger.info(
-            f"Instance {instance_id} provisioned successfully",
-            extra={"method": "PUT", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 200}
+            "Instance %s provisioned successfully", instance_id,
+            extra={"method": "PUT", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": status_code}
         )
-        return result
+        if BROKER_PASSTHROUGH:
+            return passthrough_response(response)
+        return FastJSONResponse(status_code=status_code, content=response.get_result())
     except Exception as e:
+        error = http_exception_for(e, 400)
         logger.error(
-            f"Failed to provision instance {instance_id}: {str(e)}",
-            extra={"method": "PUT", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 400}
+            "Failed to provision instance %s: %s", instance_id, e,
+            extra={"method": "PUT", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": error.status_code}
         )
-        raise HTTPException(status_code=400, detail=str(e))
+        raise error
  
 # Atualizar uma instância de serviço
 @app.patch("/v2/service_instances/{instance_id}")
-async def update_service_instance(instance_id: str, body: ServiceRequest):
+async def update_service_instance(instance_id: str, body: ServiceUpdateRequest):
     """
     Atualiza uma instância de serviço existente.
     """
     logger.info(
-        f"Updating instance {instance_id} with service_id={body.service_id}, plan_id={body.plan_id}",
+        "Updating instance %s with service_id=%s, plan_id=%s", instance_id, body.service_id, body.plan_id,
         extra={"method": "PATCH", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 0}
     )
     try:
-        result = broker_service.update_service_instance(
-            instance_id=instance_id,
-            service_id=body.service_id,
-            plan_id=body.plan_id,
-            parameters=body.parameters,
-            accepts_incomplete=body.accepts_incomplete
-        ).get_result()
+        validate_against_catalog(body, check_plan_change=True)
+        async with instance_locks.hold(instance_id):
+            try:
+                response = await broker_service.update_service_instance(
+                    instance_id=instance_id,
+                    service_id=body.service_id,
+                    plan_id=body.plan_id,
+                    parameters=body.parameters,
+                    previous_values=body.previous_values,
+                    accepts_incomplete=body.accepts_incomplete,
+                    stream=BROKER_PASSTHROUGH
+                )
+            finally:
+                last_operation_cache.invalidate(instance_id)
+            if idempotency_store:
+                await idempotency_store.discard(instance_id)
         logger.info(
-            f"Instance {instance_id} updated successfully",
-            extra={"method": "PATCH", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 200}
+            "Instance %s updated successfully", instance_id,
+            extra={"method": "PATCH", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": response.get_status_code()}
         )
-        return result
+        if BROKER_PASSTHROUGH:
+            return passthrough_response(response)
+        return response.get_result()
     except Exception as e:
+        error = http_exception_for(e, 400)
         logger.error(
-            f"Failed to update instance {instance_id}: {str(e)}",
-            extra={"method": "PATCH", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 400}
+            "Failed to update instance %s: %s", instance_id, e,
+            extra={"method": "PATCH", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": error.status_code}
         )
-        raise HTTPException(status_code=400, detail=str(e))
+        raise error
  
 # Deprovisionar (deletar) uma instância de serviço
 @app.delete("/v2/service_instances/{instance_id}")
@@ -185,24 +662,306 @@ async def deprovision_service_instance(instance_id: str, service_id: str, plan_i
     Deleta uma instância de serviço com base no instance_id, service_id e plan_id.
     """
     logger.info(
-        f"Deprovisioning instance {instance_id} with service_id={service_id}, plan_id={plan_id}",
+        "Deprovisioning instance %s with service_id=%s, plan_id=%s", instance_id, service_id, plan_id,
         extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 0}
     )
+    if await gone_instances.check(instance_id):
+        logger.info(
+            "Instance %s already gone, answered locally", instance_id,
+            extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 410}
+        )
+        return FastJSONResponse(status_code=410, content={})
     try:
-        result = broker_service.delete_service_instance(
+        async with instance_locks.hold(instance_id):
+            try:
+                response = await broker_service.delete_service_instance(
+                    instance_id=instance_id,
+                    service_id=service_id,
+                    plan_id=plan_id,
+                    accepts_incomplete=accepts_incomplete,
+                    stream=BROKER_PASSTHROUGH
+                )
+            finally:
+                last_operation_cache.invalidate(instance_id)
+                instance_state_cache.invalidate(instance_id)
+            if idempotency_store:
+                await idempotency_store.discard(instance_id)
+            if response.get_status_code() == 200:
+                await gone_instances.mark(instance_id)
+        logger.info(
+            "Instance %s deprovisioned successfully", instance_id,
+            extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": response.get_status_code()}
+        )
+        if BROKER_PASSTHROUGH:
+            return passthrough_response(response)
+        return response.get_result()
+    except ApiException as e:
+        if e.status_code in (404, 410):
+            await gone_instances.mark(instance_id)
+            if idempotency_store:
+                await idempotency_store.discard(instance_id)
+            logger.info(
+                "Instance %s not found upstream", instance_id,
+                extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 410}
+            )
+            return FastJSONResponse(status_code=410, content={})
+        error = http_exception_for(e, 400)
+        logger.error(
+            "Failed to deprovision instance %s: %s", instance_id, e,
+            extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": error.status_code}
+        )
+        raise error
+    except Exception as e:
+        error = http_exception_for(e, 400)
+        logger.error(
+            "Failed to deprovision instance %s: %s", instance_id, e,
+            extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": error.status_code}
+        )
+        raise error
+ 
+# Consultar o estado da última operação assíncrona de uma instância
+@app.get("/v2/service_instances/{instance_id}/last_operation")
+async def get_last_operation(instance_id: str, service_id: Optional[str] = None, plan_id: Optional[str] = None, operation: Optional[str] = None):
+    """
+    Retorna o estado (in progress, succeeded, failed) da última operação da instância.
+    """
+    logger.info(
+        "Fetching last operation of instance %s (operation=%s)", instance_id, operation,
+        extra={"method": "GET", "endpoint": f"/v2/service_instances/{instance_id}/last_operation", "status_code": 0}
+    )
+    cached = last_operation_cache.get(instance_id, operation)
+    if cached is not None:
+        return cached
+    if await gone_instances.check(instance_id):
+        return FastJSONResponse(status_code=410, content={})
+    try:
+        response = await broker_service.get_last_operation(
             instance_id=instance_id,
-            service_id=service_id,
+            operation=operation,
             plan_id=plan_id,
-            accepts_incomplete=accepts_incomplete
-        ).get_result()
+            service_id=service_id
+        )
+        result = response.get_result()
+        last_operation_cache.store(instance_id, operation, result)
+        if BROKER_PASSTHROUGH:
+            return passthrough_response(response)
+        return result
+    except ApiException as e:
+        if e.status_code in (404, 410):
+            # Mesma resposta da primeira chamada e das seguintes (respondidas pelo cache de instâncias removidas)
+            await gone_instances.mark(instance_id)
+            return FastJSONResponse(status_code=410, content={})
+        error = http_exception_for(e, 400)
+    except Exception as e:
+        error = http_exception_for(e, 400)
+    logger.error(
+        "Failed to get last operation of instance %s: %s", instance_id, error.detail,
+        extra={"method": "GET", "endpoint": f"/v2/service_instances/{instance_id}/last_operation", "status_code": error.status_code}
+    )
+    raise error
+ 
+# Consultar o estado (habilitada/desabilitada) de uma instância
+@app.get("/bluemix_v1/service_instances/{instance_id}")
+async def get_service_instance_state(instance_id: str):
+    """
+    Retorna o estado atual da instância de serviço.
+    """
+    logger.info(
+        "Fetching state of instance %s", instance_id,
+        extra={"method": "GET", "endpoint": f"/bluemix_v1/service_instances/{instance_id}", "status_code": 0}
+    )
+    try:
+        return await instance_state_cache.get(instance_id)
+    except Exception as e:
+        error = http_exception_for(e, 400)
+        logger.error(
+            "Failed to fetch state of instance %s: %s", instance_id, e,
+            extra={"method": "GET", "endpoint": f"/bluemix_v1/service_instances/{instance_id}", "status_code": error.status_code}
+        )
+        raise error
+ 
+# Habilitar ou desabilitar uma instância
+@app.put("/bluemix_v1/service_instances/{instance_id}")
+async def replace_service_instance_state(instance_id: str, body: InstanceStateRequest):
+    """
+    Habilita ou desabilita a instância de serviço.
+    """
+    logger.info(
+        "Updating state of instance %s to enabled=%s", instance_id, body.enabled,
+        extra={"method": "PUT", "endpoint": f"/bluemix_v1/service_instances/{instance_id}", "status_code": 0}
+    )
+ 
+    async def write_state() -> Dict:
+        response = await broker_service.replace_service_instance_state(
+            instance_id=instance_id,
+            enabled=body.enabled,
+            initiator_id=body.initiator_id,
+            reason_code=body.reason_code
+        )
+        return response.get_result()
+ 
+    try:
+        async with instance_locks.hold(instance_id):
+            result = await instance_state_cache.replace(instance_id, write_state)
         logger.info(
-            f"Instance {instance_id} deprovisioned successfully",
-            extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 200}
+            "State of instance %s updated successfully", instance_id,
+            extra={"method": "PUT", "endpoint": f"/bluemix_v1/service_instances/{instance_id}", "status_code": 200}
         )
         return result
     except Exception as e:
+        error = http_exception_for(e, 400)
         logger.error(
-            f"Failed to deprovision instance {instance_id}: {str(e)}",
-            extra={"method": "DELETE", "endpoint": f"/v2/service_instances/{instance_id}", "status_code": 400}
+            "Failed to update state of instance %s: %s", instance_id, e,
+            extra={"method": "PUT", "endpoint": f"/bluemix_v1/service_instances/{instance_id}", "status_code": error.status_code}
+        )
+        raise error
+ 
+# Converte o retorno de uma rota (dict ou Response) em status e corpo JSON
+async def route_outcome(outcome: Any) -> Tuple[int, Any]:
+    if not isinstance(outcome, Response):
+        return 200, outcome
+    if isinstance(outcome, StreamingResponse):
+        content = b"".join([chunk async for chunk in outcome.body_iterator])
+        if outcome.background is not None:
+            await outcome.background()
+    else:
+        content = outcome.body
+    if not content:
+        return outcome.status_code, None
+    try:
+        return outcome.status_code, json_loads(content)
+    except ValueError:
+        return outcome.status_code, content.decode("utf-8", "replace")
+ 
+# Executa um item do lote pelas mesmas rotas de provision, update e delete (locks, caches e idempotência).
+# Cada item tem o prazo da rota da sua operação: o prazo da requisição em lote não vale para os itens,
+# senão um lote grande falharia com 504 a partir de certo item apenas por ser grande
+async def run_bulk_instance_item(index: int, raw: Any) -> Dict:
+    result = {"index": index}
+    if isinstance(raw, dict):
+        result["operation"] = raw.get("operation")
+        result["instance_id"] = raw.get("instance_id")
+    try:
+        item = BulkInstanceItem.model_validate(raw)
+    except ValidationError as e:
+        result.update(status_code=422, error=e.errors(include_url=False, include_context=False))
+        return result
+    token = set_deadline(deadline_policy.deadline_for(item.operation))
+    try:
+        try:
+            if item.operation == "delete":
+                outcome = await deprovision_service_instance(
+                    item.instance_id, item.service_id, item.plan_id, item.accepts_incomplete
+                )
+            elif item.operation == "provision":
+                body = ServiceRequest.model_validate(item.model_dump(exclude={"operation", "instance_id"}))
+                outcome = await provision_service_instance(item.instance_id, body)
+            else:
+                body = ServiceUpdateRequest.model_validate(
+                    item.model_dump(exclude={"operation", "instance_id", "organization_guid", "space_guid"})
+                )
+                outcome = await update_service_instance(item.instance_id, body)
+        except ValidationError as e:
+            result.update(status_code=422, error=e.errors(include_url=False, include_context=False))
+            return result
+        except HTTPException as e:
+            result.update(status_code=e.status_code, error=e.detail)
+            return result
+        result["status_code"], result["body"] = await route_outcome(outcome)
+    finally:
+        reset_deadline(token)
+    return result
+ 
+# Provisionar, atualizar e deprovisionar instâncias em lote
+@app.post("/v2/bulk/service_instances")
+async def bulk_service_instances(request: Request):
+    """
+    Recebe um array JSON ou NDJSON (application/x-ndjson) de itens {"operation": "provision" | "update" | "delete",
+    "instance_id", "service_id", "plan_id", ...} e os executa com concorrência limitada (BULK_MAX_CONCURRENCY).
+    Responde em NDJSON com o resultado de cada item assim que ele termina, seguido de uma linha com o resumo.
+    """
+    logger.info(
+        "Bulk service instance request received",
+        extra={"method": "POST", "endpoint": "/v2/bulk/service_instances", "status_code": 0}
+    )
+    # O corpo é lido antes de responder: o middleware HTTP não permite lê-lo durante o streaming da resposta
+    body = await request.body()
+    items = iter_items(request.headers.get("Content-Type"), body)
+    results = fan_out(items, run_bulk_instance_item, concurrency=BULK_MAX_CONCURRENCY, max_items=BULK_MAX_ITEMS)
+    return StreamingResponse(ndjson_lines(results), media_type=NDJSON_MEDIA_TYPE)
+ 
+# Consulta um item do lote pela rota de last_operation (cache, instâncias removidas e coalescência),
+# limitada a LAST_OPERATION_BATCH_ITEM_TIMEOUT para que uma instância lenta não atrase o lote.
+# Como nos itens de /v2/bulk/service_instances, cada consulta tem o seu próprio prazo (o da rota last_operation)
+async def run_last_operation_query(index: int, query: LastOperationQuery) -> Dict:
+    result = {"index": index, "instance_id": query.instance_id, "operation": query.operation}
+    token = set_deadline(deadline_policy.deadline_for("last_operation"))
+    try:
+        outcome = await asyncio.wait_for(
+            get_last_operation(query.instance_id, query.service_id, query.plan_id, query.operation),
+            LAST_OPERATION_BATCH_ITEM_TIMEOUT
+        )
+        result["status_code"], result["body"] = await route_outcome(outcome)
+    except asyncio.TimeoutError:
+        result.update(status_code=504, error="Tempo de espera pela resposta do broker esgotado")
+    except HTTPException as e:
+        result.update(status_code=e.status_code, error=e.detail)
+    finally:
+        reset_deadline(token)
+    return result
+ 
+# Consultar a última operação de várias instâncias em uma única chamada
+@app.post("/v2/bulk/last_operation")
+async def batch_last_operation(queries: List[LastOperationQuery]):
+    """
+    Recebe uma lista de {"instance_id", "operation", "service_id", "plan_id"} e consulta as últimas operações
+    em paralelo (até LAST_OPERATION_BATCH_CONCURRENCY), retornando os resultados na ordem recebida e um resumo.
+    """
+    if len(queries) > LAST_OPERATION_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"O lote tem {len(queries)} itens; o limite é {LAST_OPERATION_BATCH_MAX_ITEMS}"
         )
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+    results = [None] * len(queries)
+    summary = None
+    async for result in fan_out(iter_list(queries), run_last_operation_query, concurrency=LAST_OPERATION_BATCH_CONCURRENCY):
+        if "summary" in result:
+            summary = result["summary"]
+        else:
+            results[result["index"]] = result
+    logger.info(
+        "Batch last_operation resolved %s items", len(queries),
+        extra={"method": "POST", "endpoint": "/v2/bulk/last_operation", "status_code": 200}
+    )
+    return {"results": results, "summary": summary}
+ 
+# Métricas internas do broker
+@app.get("/metrics")
+async def metrics():
+    """
+    Retorna os contadores internos (pool de threads, locks, coalescência de leituras, caches, token IAM, circuit breakers, prazos, fila e amostragem de logs).
+    """
+    result = {
+        "client_mode": BROKER_CLIENT_MODE,
+        "instance_locks": instance_locks.snapshot(),
+        "single_flight": single_flight.snapshot(),
+        "catalog_cache": catalog_cache.snapshot(),
+        "last_operation_cache": last_operation_cache.snapshot(),
+        "instance_state_cache": instance_state_cache.snapshot(),
+        "gone_instances": gone_instances.snapshot(),
+        "iam_token": iam_token_manager.snapshot(),
+        "retry": retry_policy.snapshot(),
+        "circuit_breakers": circuit_breakers.snapshot(),
+        "deadline": deadline_policy.snapshot(),
+        "logging": log_pipeline.snapshot(),
+        "log_sampling": route_sampler.snapshot()
+    }
+    if idempotency_store is not None:
+        result["idempotency"] = idempotency_store.snapshot()
+    if transport is not None:
+        result["transport"] = transport.snapshot()
+    if upstream_pool is not None:
+        result["upstream_pool"] = upstream_pool.snapshot()
+    if offload_dispatcher is not None:
+        result["offload"] = offload_dispatcher.snapshot()
+    return result
\ No newline at end of file
@@ -0,0 +1,239 @@
+# coding: utf-8
+
+"""
+Negative cache of service instances known to be gone.
+
+`GoneInstanceCache` remembers instance ids that upstream reported as deleted
+(a 200 on deprovision, or a 404 / 410 on deprovision or last_operation), so that
+platform retries of the same DELETE or last_operation poll are answered
+`410 Gone` locally. Entries live in a bounded TTL cache; an optional Bloom filter
+keeps remembering ids after they expire or are evicted, at a configurable false
+positive rate. Ids that are provisioned again while a Bloom generation may still
+contain them are kept in a "revived" set, since a Bloom filter cannot forget;
+the set is trimmed whenever the oldest generation is dropped.
+
+With a `path`, the gone ids are kept in a bounded SQLite table shared by the
+workers of one host instead of in the memory of each worker, so an instance
+provisioned again through one worker stops being answered `410 Gone` by all of
+them. The table is then the only memory: a per-worker Bloom filter could not
+learn that another worker revived an id, so it is not used.
+"""
+
+import asyncio
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from ttl_cache import DEFAULT_MAX_ENTRIES, TTLCache
+
+DEFAULT_TTL = 300.0
+DEFAULT_BLOOM_ERROR_RATE = 0.001
+PRUNE_INTERVAL = 100
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS gone_instances ('
+    ' instance_id TEXT PRIMARY KEY,'
+    ' gone INTEGER NOT NULL,'
+    ' updated_at REAL NOT NULL)'
+)
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter of strings."""
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_BLOOM_ERROR_RATE) -> None:
+        """
+        Initialize a BloomFilter.
+
+        :param int capacity: Number of items the filter is sized for.
+        :param float error_rate: False positive rate once `capacity` items were added.
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        """Add `item` to the filter."""
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def is_full(self) -> bool:
+        """Return `True` once `capacity` items were added."""
+        return self.count >= self.capacity
+
+
+class GoneInstanceCache:
+    """Bounded memory of deleted instance ids, with an optional Bloom filter tier."""
+
+    def __init__(
+        self,
+        *,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        bloom_capacity: int = 0,
+        bloom_error_rate: float = DEFAULT_BLOOM_ERROR_RATE,
+        path: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize a GoneInstanceCache.
+
+        :param float ttl: Seconds an instance id is remembered in the exact cache.
+        :param int max_entries: Number of ids kept in the exact cache (or in the
+               shared table) before the least recently marked one is evicted.
+        :param int bloom_capacity: (optional) Number of ids per Bloom filter
+               generation; `0` disables the filter. Two generations are kept, the
+               oldest being dropped when the current one is full. Ignored with a
+               `path`.
+        :param float bloom_error_rate: False positive rate of each generation.
+        :param str path: (optional) SQLite database file sharing the gone ids
+               between workers; use the same path in every worker. Without it
+               each worker only knows the ids it saw itself.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self._local = threading.local()
+        self._writes_since_prune = 0
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self._gone = TTLCache(max_entries=max_entries)
+        self._revived: Set[str] = set()
+        self._blooms = [BloomFilter(bloom_capacity, bloom_error_rate)] if bloom_capacity > 0 and not path else []
+        self.marked = 0
+        self.answered = 0
+        self.bloom_answered = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _write(self, instance_id: str) -> None:
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO gone_instances (instance_id, gone, updated_at) VALUES (?, 1, ?)',
+            (instance_id, time.time()),
+        )
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= PRUNE_INTERVAL:
+            self._writes_since_prune = 0
+            # Expired ids, then the oldest ones past max_entries
+            connection.execute('DELETE FROM gone_instances WHERE updated_at <= ?', (time.time() - self.ttl,))
+            connection.execute(
+                'DELETE FROM gone_instances WHERE instance_id IN ('
+                ' SELECT instance_id FROM gone_instances ORDER BY updated_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+
+    def _shared_state(self, instance_id: str) -> bool:
+        row = self._connection().execute(
+            'SELECT updated_at FROM gone_instances WHERE instance_id = ? AND gone = 1', (instance_id,)
+        ).fetchone()
+        return row is not None and row[0] > time.time() - self.ttl
+
+    def mark_gone(self, instance_id: str) -> None:
+        """Remember that `instance_id` no longer exists upstream (blocking with a `path`)."""
+        self.marked += 1
+        if self.path:
+            self._write(instance_id)
+            return
+        self._gone.set(instance_id, True, self.ttl)
+        self._revived.discard(instance_id)
+        if self._blooms:
+            if self._blooms[-1].is_full():
+                self._blooms = [self._blooms[-1], BloomFilter(self.bloom_capacity, self.bloom_error_rate)]
+                # Ids only in the dropped generation can no longer be Bloom hits
+                self._revived = {revived for revived in self._revived if self._in_bloom(revived)}
+            self._blooms[-1].add(instance_id)
+
+    def forget(self, instance_id: str) -> None:
+        """Stop treating `instance_id` as gone; call before provisioning it (blocking with a `path`)."""
+        if self.path:
+            self._connection().execute('DELETE FROM gone_instances WHERE instance_id = ?', (instance_id,))
+            return
+        self._gone.pop(instance_id)
+        if self._blooms and self._in_bloom(instance_id):
+            self._revived.add(instance_id)
+
+    def _in_bloom(self, instance_id: str) -> bool:
+        return any(instance_id in bloom for bloom in self._blooms)
+
+    def is_gone(self, instance_id: str) -> bool:
+        """Return `True` if `instance_id` is known (or, through the Bloom filter, very likely) to be gone (blocking with a `path`)."""
+        if self.path:
+            if self._shared_state(instance_id):
+                self.answered += 1
+                return True
+            return False
+        if self._gone.get(instance_id) is not None:
+            self.answered += 1
+            return True
+        if self._blooms and self._in_bloom(instance_id) and instance_id not in self._revived:
+            self.answered += 1
+            self.bloom_answered += 1
+            return True
+        return False
+
+    async def check(self, instance_id: str) -> bool:
+        """Run `is_gone`, on a worker thread with a `path`."""
+        if self.path:
+            return await asyncio.to_thread(self.is_gone, instance_id)
+        return self.is_gone(instance_id)
+
+    async def mark(self, instance_id: str) -> None:
+        """Run `mark_gone`, on a worker thread with a `path`."""
+        if self.path:
+            await asyncio.to_thread(self.mark_gone, instance_id)
+        else:
+            self.mark_gone(instance_id)
+
+    async def discard(self, instance_id: str) -> None:
+        """Run `forget`, on a worker thread with a `path`."""
+        if self.path:
+            await asyncio.to_thread(self.forget, instance_id)
+        else:
+            self.forget(instance_id)
+
+    def snapshot(self) -> Dict:
+        """Return the cache counters as a json dictionary."""
+        result = {'shared': True, 'ttl': self.ttl} if self.path else self._gone.snapshot()
+        result.update({
+            'marked': self.marked,
+            'answered': self.answered,
+            'revived': None if self.path else len(self._revived),
+            'bloom': self._bloom_snapshot(),
+        })
+        return result
+
+    def _bloom_snapshot(self) -> Optional[Dict]:
+        if not self._blooms:
+            return None
+        return {
+            'capacity': self.bloom_capacity,
+            'error_rate': self.bloom_error_rate,
+            'generations': len(self._blooms),
+            'count': sum(bloom.count for bloom in self._blooms),
+            'answered': self.bloom_answered,
+        }
@@ -0,0 +1,196 @@
+# coding: utf-8
+
+"""
+Bounded thread-pool offload for the synchronous SDK calls.
+
+`OffloadDispatcher` runs blocking callables in a dedicated thread pool instead of on
+the event loop, with a concurrency limit per operation, a bounded wait queue and
+queue-depth / wait-time counters. `OffloadedOpenServiceBrokerV1` exposes the
+synchronous `OpenServiceBrokerV1` operations as coroutines through a dispatcher.
+"""
+
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from single_flight import SingleFlight
+
+DEFAULT_MAX_WORKERS = 32
+DEFAULT_OPERATION_LIMIT = 8
+DEFAULT_MAX_QUEUE = 128
+
+
+class OffloadQueueFull(Exception):
+    """Raised when an operation cannot be queued because the wait queue is full."""
+
+    def __init__(self, operation: str) -> None:
+        super().__init__('Offload queue is full for operation {0}'.format(operation))
+        self.operation = operation
+
+
+class _OperationStats:
+    """Counters kept per offloaded operation."""
+
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'wait_time_total': self.wait_time_total,
+            'wait_time_max': self.wait_time_max,
+        }
+
+
+class OffloadDispatcher:
+    """Run blocking callables on a dedicated, bounded thread pool."""
+
+    def __init__(
+        self,
+        *,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        limits: Dict[str, int] = None,
+        default_limit: int = DEFAULT_OPERATION_LIMIT,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ) -> None:
+        """
+        Initialize an OffloadDispatcher.
+
+        :param int max_workers: Size of the thread pool.
+        :param dict limits: (optional) Concurrency limit keyed by operation name.
+        :param int default_limit: Concurrency limit for operations not in `limits`.
+        :param int max_queue: Maximum number of calls waiting for a free slot,
+               across all operations. Calls beyond it raise `OffloadQueueFull`.
+        """
+        self.max_workers = max_workers
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='broker-offload')
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, _OperationStats] = {}
+        self._waiting = 0
+
+    def _semaphore(self, operation: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(operation)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limits.get(operation, self.default_limit))
+            self._semaphores[operation] = semaphore
+            self._stats[operation] = _OperationStats()
+        return semaphore
+
+    async def run(self, operation: str, func: Callable, /, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` on the thread pool under the limit of `operation`.
+
+        The caller's context variables are propagated to the worker thread.
+
+        :raises OffloadQueueFull: The operation would have to wait and the wait queue is full.
+        """
+        semaphore = self._semaphore(operation)
+        stats = self._stats[operation]
+        if semaphore.locked() and self._waiting >= self.max_queue:
+            stats.rejected += 1
+            raise OffloadQueueFull(operation)
+
+        stats.submitted += 1
+        self._waiting += 1
+        stats.queue_depth += 1
+        stats.max_queue_depth = max(stats.max_queue_depth, stats.queue_depth)
+        start = time.monotonic()
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+            stats.queue_depth -= 1
+        waited = time.monotonic() - start
+        stats.wait_time_total += waited
+        stats.wait_time_max = max(stats.wait_time_max, waited)
+
+        stats.in_flight += 1
+        try:
+            context = contextvars.copy_context()
+            call = functools.partial(context.run, func, *args, **kwargs)
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        except BaseException:
+            stats.failed += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+            semaphore.release()
+        stats.completed += 1
+        return result
+
+    def snapshot(self) -> Dict:
+        """Return the dispatcher counters as a json dictionary."""
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'queue_depth': self._waiting,
+            'operations': {name: stats.to_dict() for (name, stats) in self._stats.items()},
+        }
+
+    def shutdown(self) -> None:
+        """Stop accepting work and release the worker threads."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class OffloadedOpenServiceBrokerV1:
+    """
+    Coroutine facade over a synchronous `OpenServiceBrokerV1`.
+
+    Every SDK operation (for example `replace_service_instance` or `list_catalog`)
+    is exposed as a coroutine that runs the blocking call through the dispatcher,
+    keyed by the operation name. Identical concurrent read operations are coalesced
+    into a single call.
+    """
+
+    READ_OPERATIONS = frozenset(['get_service_instance_state', 'list_catalog', 'get_last_operation'])
+
+    def __init__(self, service, dispatcher: OffloadDispatcher, single_flight: SingleFlight = None) -> None:
+        self.service = service
+        self.dispatcher = dispatcher
+        self.single_flight = single_flight if single_flight is not None else SingleFlight()
+
+    def __getattr__(self, name: str):
+        func = getattr(self.service, name)
+
+        async def call(*args, **kwargs):
+            if name in self.READ_OPERATIONS and 'headers' not in kwargs:
+                key = (name, args, tuple(sorted(kwargs.items())))
+                return await self.single_flight.do(key, lambda: self.dispatcher.run(name, func, *args, **kwargs))
+            return await self.dispatcher.run(name, func, *args, **kwargs)
+
+        return call
+
+    async def close(self) -> None:
+        """Shut down the dispatcher's thread pool."""
+        self.dispatcher.shutdown()
+
+
+def parse_limits(value: str) -> Dict[str, int]:
+    """Parse `operation=limit` pairs separated by commas, e.g. `list_catalog=2,delete_service_instance=4`."""
+    limits = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition('=')
+        limits[name.strip()] = int(limit)
+    return limits
@@ -0,0 +1,101 @@
+# coding: utf-8
+
+"""
+Raw passthrough of upstream broker responses.
+
+`RawDetailedResponse` is the `DetailedResponse` returned by `AsyncOpenServiceBrokerV1`:
+it keeps the upstream body as bytes and only decodes it when `get_result()` is
+called, e.g. by a cache or a validator. `passthrough_response` turns it into a
+Starlette response carrying the upstream status, a selection of upstream headers
+and the raw body, so a route can answer without decoding and re-encoding the json.
+Bodies requested with `stream=True` that are larger than the client threshold (or
+of unknown length) stay unread and are streamed to the caller as they arrive.
+"""
+
+from typing import Dict, Optional
+
+import httpx
+from fastapi.responses import Response, StreamingResponse
+from ibm_cloud_sdk_core import ApiException, DetailedResponse
+from ibm_cloud_sdk_core.utils import is_json_mimetype
+from starlette.background import BackgroundTask
+
+from common import json_loads
+from json_response import FastJSONResponse
+
+PASSTHROUGH_HEADERS = ('content-type', 'cache-control', 'etag', 'last-modified', 'location', 'retry-after')
+STREAM_HEADERS = PASSTHROUGH_HEADERS + ('content-encoding',)
+
+_UNDECODED = object()
+
+
+class RawDetailedResponse(DetailedResponse):
+    """A DetailedResponse whose json result is decoded on first access."""
+
+    def __init__(
+        self,
+        *,
+        content: Optional[bytes] = None,
+        stream: Optional[httpx.Response] = None,
+        headers: Optional[Dict[str, str]] = None,
+        status_code: Optional[int] = None,
+    ) -> None:
+        """
+        Initialize a RawDetailedResponse.
+
+        :param bytes content: (optional) The upstream body, read in full.
+        :param httpx.Response stream: (optional) The upstream response whose body
+               has not been read yet; mutually exclusive with `content`.
+        :param dict headers: The upstream response headers.
+        :param int status_code: The upstream status code.
+        """
+        super().__init__(headers=headers, status_code=status_code)
+        self.content = content
+        self.stream = stream
+        self._result = stream if stream is not None else _UNDECODED
+
+    @property
+    def result(self):
+        if self._result is _UNDECODED:
+            self._result = self._decode()
+        return self._result
+
+    @result.setter
+    def result(self, value) -> None:
+        self._result = _UNDECODED if value is None else value
+
+    def _decode(self):
+        if not self.content or self.status_code == 204:
+            return None
+        if not is_json_mimetype(self.headers.get('Content-Type')):
+            return self.content
+        try:
+            return json_loads(self.content)
+        except ValueError as err:
+            raise ApiException(self.status_code, message='Error processing the HTTP response') from err
+
+    def is_streamed(self) -> bool:
+        """Return `True` if the body is still to be read from upstream."""
+        return self.stream is not None
+
+
+def passthrough_response(response: DetailedResponse) -> Response:
+    """
+    Build the route response for an upstream response without re-encoding its body.
+
+    A plain `DetailedResponse` (e.g. from the synchronous SDK) has no raw body and
+    is answered as json from its decoded result.
+    """
+    if not isinstance(response, RawDetailedResponse):
+        return FastJSONResponse(status_code=response.get_status_code(), content=response.get_result())
+    upstream_headers = response.get_headers() or {}
+    if response.is_streamed():
+        headers = {name: upstream_headers[name] for name in STREAM_HEADERS if name in upstream_headers}
+        return StreamingResponse(
+            response.stream.aiter_raw(),
+            status_code=response.get_status_code(),
+            headers=headers,
+            background=BackgroundTask(response.stream.aclose),
+        )
+    headers = {name: upstream_headers[name] for name in PASSTHROUGH_HEADERS if name in upstream_headers}
+    return Response(content=response.content or b'', status_code=response.get_status_code(), headers=headers)
@@ -0,0 +1,258 @@
+# coding: utf-8
+
+"""
+Retries of idempotent upstream calls, bounded by a retry budget.
+
+`RetryPolicy` retries a request that failed with a transient error (a 502 / 503 /
+504 response or a transport error) when it is safe to send it again: GET, HEAD and
+DELETE requests, and PUT requests carrying an `Idempotency-Key` header. Any request
+is retried when the connection could not even be opened, since nothing reached
+upstream. Delays follow "decorrelated jitter" backoff and honor `Retry-After`.
+
+A retry is not attempted when the backoff would outlast the deadline of the
+incoming request (see `deadline`). Every retry is paid for by a token of a `RetryBudget` shared by all calls, which
+earns a fraction of a token per request. During an outage the budget runs out and
+failures are returned at once, so retries cannot multiply the load on upstream.
+"""
+
+import asyncio
+import email.utils
+import functools
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+import requests
+from ibm_cloud_sdk_core import ApiException
+
+from deadline import current_deadline
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'DELETE', 'OPTIONS'])
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+# Failures raised before the request was sent: safe to retry whatever the method
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, requests.exceptions.ConnectTimeout)
+# Failures after which an idempotent request may be sent again
+_TRANSPORT_ERRORS = (httpx.TransportError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of the requests."""
+
+    def __init__(self, *, ratio: float = 0.1, min_per_second: float = 1.0, max_tokens: float = 10.0) -> None:
+        """
+        Initialize a RetryBudget.
+
+        :param float ratio: Tokens earned per request, i.e. the share of requests
+               that may be retried once the bucket is empty.
+        :param float min_per_second: Tokens earned per second regardless of
+               traffic, so that low traffic can still be retried.
+        :param float max_tokens: Capacity of the bucket.
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, earned: float) -> None:
+        now = time.monotonic()
+        earned += (now - self._updated_at) * self.min_per_second
+        self._updated_at = now
+        self._tokens = min(self._tokens + earned, self.max_tokens)
+
+    def deposit(self) -> None:
+        """Record a request."""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take a token for a retry; return `False` if the budget is exhausted."""
+        with self._lock:
+            self._refill(0.0)
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def tokens(self) -> float:
+        """Return the tokens currently available."""
+        with self._lock:
+            self._refill(0.0)
+            return self._tokens
+
+
+class RetryPolicy:
+    """Decides whether and when to retry a failed upstream request."""
+
+    def __init__(
+        self,
+        *,
+        max_attempts: int = 3,
+        base_delay: float = 0.1,
+        max_delay: float = 2.0,
+        max_retry_after: float = 10.0,
+        budget: Optional[RetryBudget] = None,
+    ) -> None:
+        """
+        Initialize a RetryPolicy.
+
+        :param int max_attempts: Attempts per request, the first one included.
+        :param float base_delay: Smallest delay between attempts, in seconds.
+        :param float max_delay: Largest backoff delay between attempts, in seconds.
+        :param float max_retry_after: Longest `Retry-After` that is waited for;
+               a longer one fails the request at once.
+        :param RetryBudget budget: (optional) Budget shared by all retries; a
+               default budget is created if omitted.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget if budget is not None else RetryBudget()
+        self.requests = 0
+        self.retries = 0
+        self.recovered = 0
+        self.budget_exhausted = 0
+        self.deadline_exhausted = 0
+        self.retry_after_waits = 0
+
+    @staticmethod
+    def is_idempotent(request: dict) -> bool:
+        """Return `True` if sending `request` twice has the effect of sending it once."""
+        if request['method'] in IDEMPOTENT_METHODS:
+            return True
+        headers = request.get('headers') or {}
+        return request['method'] == 'PUT' and any(name.lower() == IDEMPOTENCY_KEY_HEADER.lower() for name in headers)
+
+    def _retryable(self, error: Exception, idempotent: bool) -> bool:
+        if isinstance(error, _NOT_SENT_ERRORS):
+            return True
+        if not idempotent:
+            return False
+        if isinstance(error, ApiException):
+            return error.status_code in RETRY_STATUSES
+        return isinstance(error, _TRANSPORT_ERRORS)
+
+    def _next_delay(self, error: Exception, attempt: int, previous_delay: float) -> Optional[float]:
+        """Return the delay before the next attempt, or `None` to give up."""
+        if attempt >= self.max_attempts:
+            return None
+        retry_after = _retry_after(error)
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        # Decorrelated jitter: random between the base delay and three times the previous delay
+        delay = min(self.max_delay, random.uniform(self.base_delay, max(previous_delay, self.base_delay) * 3))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() - delay < deadline.policy.min_budget:
+            self.deadline_exhausted += 1
+            return None
+        if not self.budget.withdraw():
+            self.budget_exhausted += 1
+            return None
+        if retry_after is not None:
+            self.retry_after_waits += 1
+        return delay
+
+    async def call(self, request: dict, send: Callable[[], Awaitable]):
+        """Run the coroutine function `send` for `request`, retrying transient failures."""
+        idempotent = self.is_idempotent(request)
+        self.requests += 1
+        self.budget.deposit()
+        attempt, delay = 1, 0.0
+        while True:
+            try:
+                response = await send()
+            except Exception as e:  # pylint: disable=broad-except
+                delay = self._next_delay(e, attempt, delay) if self._retryable(e, idempotent) else None
+                if delay is None:
+                    raise
+                self._log_retry(request, e, attempt, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if attempt > 1:
+                self.recovered += 1
+            return response
+
+    def call_sync(self, request: dict, send: Callable[[], object]):
+        """Blocking variant of `call` for the synchronous SDK client."""
+        idempotent = self.is_idempotent(request)
+        self.requests += 1
+        self.budget.deposit()
+        attempt, delay = 1, 0.0
+        while True:
+            try:
+                response = send()
+            except Exception as e:  # pylint: disable=broad-except
+                delay = self._next_delay(e, attempt, delay) if self._retryable(e, idempotent) else None
+                if delay is None:
+                    raise
+                self._log_retry(request, e, attempt, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if attempt > 1:
+                self.recovered += 1
+            return response
+
+    def _log_retry(self, request: dict, error: Exception, attempt: int, delay: float) -> None:
+        self.retries += 1
+        logger.info(
+            'Retrying %s %s in %.2fs after attempt %d failed: %s',
+            request['method'], request['url'], delay, attempt, error
+        )
+
+    def snapshot(self) -> Dict:
+        """Return the retry counters as a json dictionary."""
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'recovered': self.recovered,
+            'budget_exhausted': self.budget_exhausted,
+            'deadline_exhausted': self.deadline_exhausted,
+            'retry_after_waits': self.retry_after_waits,
+            'budget_tokens': self.budget.tokens(),
+        }
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Return the `Retry-After` delay of an error response, in seconds, or `None`."""
+    http_response = getattr(error, 'http_response', None)
+    value = http_response.headers.get('Retry-After') if http_response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def install_sync_retry(service, policy: RetryPolicy) -> None:
+    """
+    Route the `send` calls of a synchronous SDK service through `policy`.
+
+    :param BaseService service: The service whose `send` is wrapped.
+    :param RetryPolicy policy: The retry policy to apply.
+    """
+    send = service.send
+
+    @functools.wraps(send)
+    def send_with_retry(request, **kwargs):
+        return policy.call_sync(request, lambda: send(request, **kwargs))
+
+    service.send = send_with_retry
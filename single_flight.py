@@ -0,0 +1,74 @@
+# coding: utf-8
+
+"""
+Single-flight coalescing of identical in-flight calls.
+
+While a call for a given key is in flight, `SingleFlight.do` makes every other
+caller with the same key wait for that call instead of starting its own, and hands
+all of them its result (or its exception).
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+DEFAULT_FOLLOWER_TIMEOUT = 30.0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution."""
+
+    def __init__(self, *, follower_timeout: Optional[float] = DEFAULT_FOLLOWER_TIMEOUT) -> None:
+        """
+        Initialize a SingleFlight group.
+
+        :param float follower_timeout: (optional) Maximum time, in seconds, a caller
+               joining an in-flight call waits for it before `asyncio.TimeoutError`
+               is raised. `None` waits for as long as the call takes.
+        """
+        self.follower_timeout = follower_timeout
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.follower_timeouts = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        """
+        Return the result of `func()`, sharing it with concurrent callers of `key`.
+
+        The call runs in its own task, so a cancelled caller does not cancel it for
+        the others.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), self.follower_timeout)
+            except asyncio.TimeoutError:
+                self.follower_timeouts += 1
+                raise
+
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        self.executions += 1
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away.
+            task.exception()
+
+    def in_flight(self) -> int:
+        """Return the number of distinct calls currently in flight."""
+        return len(self._calls)
+
+    def snapshot(self) -> Dict:
+        """Return the coalescing counters as a json dictionary."""
+        return {
+            'in_flight': len(self._calls),
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'follower_timeouts': self.follower_timeouts,
+        }
@@ -0,0 +1,50 @@
+# coding: utf-8
+
+from negative_cache import GoneInstanceCache
+
+
+def revive_then_churn(cache: GoneInstanceCache) -> None:
+    cache.mark_gone('x')
+    cache.forget('x')
+    for i in range(200):
+        cache.forget('other-%d' % i)
+
+
+def test_revived_id_stays_live_in_memory():
+    cache = GoneInstanceCache(max_entries=50, bloom_capacity=1000)
+    revive_then_churn(cache)
+    assert not cache.is_gone('x')
+
+
+def test_many_revived_ids_stay_live_in_memory():
+    cache = GoneInstanceCache(max_entries=50, bloom_capacity=1000)
+    for i in range(200):
+        cache.mark_gone('revived-%d' % i)
+        cache.forget('revived-%d' % i)
+    assert not any(cache.is_gone('revived-%d' % i) for i in range(200))
+
+
+def test_revived_id_stays_live_after_bloom_rotation():
+    cache = GoneInstanceCache(max_entries=50, bloom_capacity=100)
+    revive_then_churn(cache)
+    for i in range(150):
+        cache.mark_gone('gone-%d' % i)
+    assert not cache.is_gone('x')
+    assert cache.is_gone('gone-0')
+
+
+def test_revived_id_stays_live_shared(tmp_path):
+    path = str(tmp_path / 'gone.sqlite3')
+    cache = GoneInstanceCache(max_entries=50, bloom_capacity=1000, path=path)
+    revive_then_churn(cache)
+    assert not cache.is_gone('x')
+    assert not GoneInstanceCache(max_entries=50, path=path).is_gone('x')
+
+
+def test_gone_id_is_shared(tmp_path):
+    path = str(tmp_path / 'gone.sqlite3')
+    GoneInstanceCache(path=path).mark_gone('x')
+    cache = GoneInstanceCache(path=path)
+    assert cache.is_gone('x')
+    cache.forget('x')
+    assert not GoneInstanceCache(path=path).is_gone('x')
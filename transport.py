@@ -0,0 +1,178 @@
+# coding: utf-8
+
+"""
+Pooled HTTP transport to the upstream broker.
+
+`PooledTransport` keeps one `httpx.AsyncClient` per upstream host, so the pool size
+and keep-alive limits apply to each host separately, optionally speaking HTTP/2
+(one multiplexed connection instead of a connection per concurrent request). Every
+request is traced to count new connections, TLS handshakes and connection reuse,
+and to measure how long the request waited for a pooled connection.
+
+`mount_pooled_adapter` applies the same pool size to the `requests` session of the
+synchronous SDK client.
+"""
+
+import logging
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from ibm_cloud_sdk_core.http_adapter import SSLHTTPAdapter
+
+try:
+    import h2  # noqa: F401  pylint: disable=unused-import
+except ImportError:  # pragma: no cover
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 200
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 50
+DEFAULT_KEEPALIVE_EXPIRY = 5.0
+DEFAULT_TIMEOUT = 60.0
+
+
+class _HostStats:
+    """Connection counters of one upstream host."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def snapshot(self) -> Dict:
+        reused = self.requests - self.new_connections
+        return {
+            'requests': self.requests,
+            'new_connections': self.new_connections,
+            'tls_handshakes': self.tls_handshakes,
+            'reuse_rate': reused / self.requests if self.requests else None,
+            'checkout_wait_avg': self.checkout_wait_total / self.requests if self.requests else 0.0,
+            'checkout_wait_max': self.checkout_wait_max,
+        }
+
+
+class _RequestTrace:
+    """httpcore trace callback recording the connection events of one request."""
+
+    def __init__(self, stats: _HostStats) -> None:
+        self.stats = stats
+        self.started_at = time.monotonic()
+        self.connect_started_at = None
+        self.connect_time = 0.0
+
+    async def __call__(self, event_name: str, info: Dict) -> None:
+        if event_name in ('connection.connect_tcp.started', 'connection.start_tls.started'):
+            self.connect_started_at = time.monotonic()
+        elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+            if self.connect_started_at is not None:
+                self.connect_time += time.monotonic() - self.connect_started_at
+            if event_name == 'connection.connect_tcp.complete':
+                self.stats.new_connections += 1
+            else:
+                self.stats.tls_handshakes += 1
+        elif event_name.endswith('send_request_headers.started'):
+            # Time until the request could be written, minus connecting: waiting for the pool
+            wait = max(time.monotonic() - self.started_at - self.connect_time, 0.0)
+            self.stats.checkout_wait_total += wait
+            self.stats.checkout_wait_max = max(self.stats.checkout_wait_max, wait)
+
+
+class PooledTransport:
+    """Per-host pools of upstream connections, with connection counters."""
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+        http2: bool = False,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        """
+        Initialize a PooledTransport.
+
+        :param int max_connections: Upper bound of open connections per upstream host.
+        :param int max_keepalive_connections: Idle connections kept per upstream host.
+        :param float keepalive_expiry: Seconds an idle connection is kept open.
+        :param bool http2: Negotiate HTTP/2 with upstream hosts that support it.
+               Needs the `h2` package (the `http2` extra of httpx in requirements.txt);
+               HTTP/1.1 is used without it.
+        :param float timeout: Default upstream timeout, in seconds.
+        """
+        if http2 and h2 is None:
+            logger.warning('HTTP/2 requested but the h2 package is not installed; using HTTP/1.1')
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self._clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._stats: Dict[Tuple[str, str], _HostStats] = {}
+
+    def _client_for(self, url: str) -> Tuple[httpx.AsyncClient, _HostStats]:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        client = self._clients.get(key)
+        if client is None:
+            client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+            self._clients[key] = client
+            self._stats[key] = _HostStats()
+        return client, self._stats[key]
+
+    async def request(self, method: str, url: str, *, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Send a request through the pool of the host of `url`.
+
+        :param bool stream: Return once the response headers arrive, leaving the
+               body to be read (and the response closed) by the caller.
+        """
+        client, stats = self._client_for(url)
+        stats.requests += 1
+        extensions = dict(kwargs.pop('extensions', None) or {})
+        extensions['trace'] = _RequestTrace(stats)
+        request = client.build_request(method, url, extensions=extensions, **kwargs)
+        return await client.send(request, stream=stream)
+
+    async def aclose(self) -> None:
+        """Close every pooled connection."""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    def snapshot(self) -> Dict:
+        """Return the pool settings and per-host counters as a json dictionary."""
+        return {
+            'http2': self.http2,
+            'max_connections': self.limits.max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'keepalive_expiry': self.limits.keepalive_expiry,
+            'hosts': {'{0}://{1}'.format(*key): stats.snapshot() for key, stats in self._stats.items()},
+        }
+
+
+def mount_pooled_adapter(service, *, max_connections: int = DEFAULT_MAX_CONNECTIONS) -> None:
+    """
+    Size the connection pool of a synchronous SDK service to `max_connections` per host.
+
+    :param BaseService service: The service whose `requests` session is configured.
+    :param int max_connections: Connections kept open per upstream host.
+    """
+    kwargs = {'max_retries': service.retry_config} if service.retry_config is not None else {}
+    service.http_adapter = SSLHTTPAdapter(
+        pool_connections=max_connections,
+        pool_maxsize=max_connections,
+        _disable_ssl_verification=service.disable_ssl_verification,
+        **kwargs,
+    )
+    session = service.get_http_client()
+    session.mount('http://', service.http_adapter)
+    session.mount('https://', service.http_adapter)
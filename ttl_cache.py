@@ -0,0 +1,92 @@
+# coding: utf-8
+
+"""
+Bounded in-memory cache with per-entry expiry and LRU eviction.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+DEFAULT_MAX_ENTRIES = 10000
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A bounded mapping whose entries expire after their own TTL."""
+
+    def __init__(
+        self, *, max_entries: int = DEFAULT_MAX_ENTRIES, on_evict: Callable[[Hashable], None] = None
+    ) -> None:
+        """
+        Initialize a TTLCache.
+
+        :param int max_entries: Number of entries kept before the least recently
+               used one is evicted.
+        :param on_evict: (optional) Called with the key of every entry removed
+               because it expired or was evicted.
+        """
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        """Return the live value of `key`, or `default`."""
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            self._evicted(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None) -> None:
+        """Store `value` under `key` for `ttl` seconds, or until removed if `ttl` is `None`."""
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._evicted(evicted)
+
+    def pop(self, key: Hashable, default=None):
+        """Remove `key` and return its value (expired or not), or `default`."""
+        entry = self._entries.pop(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        return entry[0]
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        self._entries.clear()
+
+    def _evicted(self, key: Hashable) -> None:
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def snapshot(self) -> Dict:
+        """Return the cache counters as a json dictionary."""
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
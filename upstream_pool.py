@@ -0,0 +1,279 @@
+# coding: utf-8
+
+"""
+Client-side load balancing over several replicas of the upstream broker.
+
+`UpstreamPool` picks the endpoint of each upstream attempt by "power of two
+choices": two endpoints are drawn at random and the cheaper one wins. The cost is
+either the number of requests in flight (`least_outstanding`) or the peak-EWMA
+latency weighted by the requests in flight (`peak_ewma`), so a replica that slows
+down quickly stops receiving new calls.
+
+Endpoints that fail `consecutive_failures` times in a row (5xx responses, timeouts,
+transport errors) are ejected for `ejection_time` seconds, longer after each new
+ejection; at most `max_ejection_percent` of the endpoints are ejected at once.
+When `probe_interval` is set, a background task also probes every endpoint and
+takes the ones that do not answer out of rotation until they do.
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from circuit_breaker import is_failure
+from deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+PEAK_EWMA = 'peak_ewma'
+LEAST_OUTSTANDING = 'least_outstanding'
+
+
+class Endpoint:
+    """One replica of the upstream broker and its load / health counters."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.ewma = 0.0
+        self._ewma_at = time.monotonic()
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def current_ewma(self, now: float, decay: float) -> float:
+        """Return the peak-EWMA decayed to `now`, so an idle endpoint is tried again."""
+        return self.ewma * math.exp(-(now - self._ewma_at) / decay)
+
+    def observe_latency(self, latency: float, decay: float) -> None:
+        """Update the peak-EWMA: jump to a higher latency at once, decay towards a lower one."""
+        now = time.monotonic()
+        weight = math.exp(-(now - self._ewma_at) / decay)
+        self._ewma_at = now
+        self.ewma = latency if latency > self.ewma else self.ewma * weight + latency * (1.0 - weight)
+
+    def to_dict(self, now: float, decay: float) -> Dict:
+        return {
+            'outstanding': self.outstanding,
+            'ewma': self.current_ewma(now, decay),
+            'healthy': self.healthy,
+            'ejected': self.is_ejected(now),
+            'ejections': self.ejections,
+            'consecutive_failures': self.consecutive_failures,
+            'requests': self.requests,
+            'failures': self.failures,
+        }
+
+
+class UpstreamPool:
+    """Balances upstream attempts over several endpoints and routes around unhealthy ones."""
+
+    def __init__(
+        self,
+        urls: List[str],
+        *,
+        policy: str = PEAK_EWMA,
+        decay: float = 10.0,
+        consecutive_failures: int = 5,
+        ejection_time: float = 30.0,
+        max_ejection_percent: float = 50.0,
+        probe_interval: float = 10.0,
+        probe_path: str = '/v2/catalog',
+        probe_timeout: float = 2.0,
+    ) -> None:
+        """
+        Initialize an UpstreamPool.
+
+        :param list urls: Base URLs of the upstream replicas.
+        :param str policy: `peak_ewma` or `least_outstanding`.
+        :param float decay: Time constant of the peak-EWMA, in seconds.
+        :param int consecutive_failures: Failures in a row that eject an endpoint.
+        :param float ejection_time: Base ejection time, multiplied by the number (up to 10)
+               of times the endpoint was ejected.
+        :param float max_ejection_percent: Upper bound of the share of endpoints
+               ejected at the same time.
+        :param float probe_interval: Seconds between health probes; 0 disables them.
+        :param str probe_path: Path requested by the probes. Any response under 500
+               counts as healthy, so the probe needs no credentials.
+        :param float probe_timeout: Timeout of a probe, in seconds.
+        """
+        if not urls:
+            raise ValueError('urls must not be empty')
+        if policy not in (PEAK_EWMA, LEAST_OUTSTANDING):
+            raise ValueError('Unknown load balancing policy: {0}'.format(policy))
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.policy = policy
+        self.decay = decay
+        self.consecutive_failures = consecutive_failures
+        self.ejection_time = ejection_time
+        self.max_ejection_percent = max_ejection_percent
+        self.probe_interval = probe_interval
+        self.probe_path = probe_path
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @property
+    def primary_url(self) -> str:
+        """The URL the SDK builds its requests with; attempts are re-targeted by `resolve`."""
+        return self.endpoints[0].url
+
+    def _cost(self, endpoint: Endpoint, now: float) -> float:
+        if self.policy == LEAST_OUTSTANDING:
+            return endpoint.outstanding
+        return endpoint.current_ewma(now, self.decay) * (endpoint.outstanding + 1)
+
+    def pick(self) -> Endpoint:
+        """Choose the endpoint of the next attempt and count it as in flight."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy and not e.is_ejected(now)]
+            if not candidates:
+                # Everything looks down: keep trying every endpoint rather than none
+                candidates = self.endpoints
+            if len(candidates) == 1:
+                endpoint = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                endpoint = first if self._cost(first, now) <= self._cost(second, now) else second
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: float, error: Optional[BaseException] = None) -> None:
+        """Record the outcome of an attempt sent to `endpoint`."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if isinstance(error, (asyncio.CancelledError, DeadlineExceeded)):
+                # Abandoned or never sent: no latency sample
+                return
+            endpoint.observe_latency(latency, self.decay)
+            if error is None or not is_failure(error):
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.consecutive_failures:
+                self._eject(endpoint)
+
+    def _eject(self, endpoint: Endpoint) -> None:
+        now = time.monotonic()
+        ejected = sum(1 for e in self.endpoints if e.is_ejected(now))
+        if endpoint.is_ejected(now) or (ejected + 1) * 100.0 > self.max_ejection_percent * len(self.endpoints):
+            return
+        endpoint.ejections += 1
+        endpoint.consecutive_failures = 0
+        endpoint.ejected_until = now + self.ejection_time * min(endpoint.ejections, 10)
+        logger.warning('Ejecting upstream %s for %.0fs', endpoint.url, endpoint.ejected_until - now)
+
+    def resolve(self, url: str, endpoint: Endpoint) -> str:
+        """Re-target a URL built against `primary_url` to `endpoint`."""
+        if url.startswith(self.primary_url):
+            return endpoint.url + url[len(self.primary_url):]
+        return url
+
+    async def call(self, request: dict, send):
+        """Run `send(request)` against the endpoint picked for it."""
+        endpoint = self.pick()
+        start = time.monotonic()
+        try:
+            response = await send(dict(request, url=self.resolve(request['url'], endpoint)))
+        except BaseException as e:
+            self.release(endpoint, time.monotonic() - start, e)
+            raise
+        self.release(endpoint, time.monotonic() - start)
+        return response
+
+    def call_sync(self, request: dict, send):
+        """Blocking variant of `call` for the synchronous SDK client."""
+        endpoint = self.pick()
+        start = time.monotonic()
+        try:
+            response = send(dict(request, url=self.resolve(request['url'], endpoint)))
+        except BaseException as e:
+            self.release(endpoint, time.monotonic() - start, e)
+            raise
+        self.release(endpoint, time.monotonic() - start)
+        return response
+
+    #########################
+    # Active health probes
+    #########################
+
+    def start(self) -> None:
+        """Start probing the endpoints in the background (no-op for a single endpoint)."""
+        if self.probe_interval > 0 and len(self.endpoints) > 1 and self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        """Stop the background probes."""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    async def _probe_loop(self) -> None:
+        async with httpx.AsyncClient(timeout=self.probe_timeout) as client:
+            while True:
+                await asyncio.gather(*(self._probe(client, endpoint) for endpoint in self.endpoints))
+                await asyncio.sleep(self.probe_interval)
+
+    async def _probe(self, client: httpx.AsyncClient, endpoint: Endpoint) -> None:
+        try:
+            response = await client.get(endpoint.url + self.probe_path, headers={'X-Broker-Api-Version': '2.12'})
+            healthy = response.status_code < 500
+        except httpx.HTTPError:
+            healthy = False
+        with self._lock:
+            if healthy != endpoint.healthy:
+                logger.warning('Upstream %s is %s', endpoint.url, 'healthy again' if healthy else 'failing health probes')
+            endpoint.healthy = healthy
+
+    def snapshot(self) -> Dict:
+        """Return the balancing policy and the per-endpoint counters as a json dictionary."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'endpoints': {endpoint.url: endpoint.to_dict(now, self.decay) for endpoint in self.endpoints},
+            }
+
+
+def install_sync_pool(service, pool: UpstreamPool) -> None:
+    """
+    Route the `send` calls of a synchronous SDK service through `pool`.
+
+    Install it before `retry.install_sync_retry`, so that each retry picks an
+    endpoint again.
+
+    :param BaseService service: The service whose `send` is wrapped.
+    :param UpstreamPool pool: The pool of upstream endpoints.
+    """
+    send = service.send
+
+    @functools.wraps(send)
+    def send_through_pool(request, **kwargs):
+        return pool.call_sync(request, lambda routed: send(routed, **kwargs))
+
+    service.send = send_through_pool
+
+
+def parse_urls(value: str) -> List[str]:
+    """Parse a comma (or whitespace) separated list of URLs."""
+    return [url for url in (value or '').replace(',', ' ').split() if url]